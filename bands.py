@@ -0,0 +1,156 @@
+import os
+import multiprocessing
+import threading
+import numpy as np
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+# runs the cellular automaton on big maps (4096 x 4096 and up) across several processes
+# the grid is split into horizontal bands, one per worker process. Two copies of the grid, each with a border of
+# wall around it, live in shared memory: every generation is read from one and written to the other, and they swap
+# roles for the next generation. A band only needs the row above and the row below it (its halo), which are read
+# straight from the shared grid, so nothing is copied between processes
+# a barrier after every generation stops a worker reading its neighbours' rows before they are finished, so the
+# result is exactly the same as CellularAutomaton.run, including the edges counting as wall
+# a worker process killed from outside never reaches the barrier, so the main process watches them and breaks the
+# barrier when one dies, and a worker whose main process is gone exits instead of waiting for it
+
+# seconds between checks that the run is still going while the processes are watched
+WATCH_SECONDS = 0.5
+
+# (first row, last row + 1) of every band, as equal as possible
+def bands(rows, count):
+    edges = np.linspace(0, rows, count + 1).astype(int)
+    return [(int(start), int(stop)) for start, stop in zip(edges[:-1], edges[1:]) if stop > start]
+
+
+# each worker steps its band every generation until it is told to stop
+# flags[2 * index] is how many cells of the band changed in the last generation, flags[2 * index + 1] is 1 if the band
+# is different from two generations ago, which is what the main process needs to spot a fixed point or a 2-cycle
+def _band_worker(memory_name, shape, band, index, iterations, barrier, flags, stop):
+    threading.Thread(target=_exit_with_parent, daemon=True).start()
+    memory = shared_memory.SharedMemory(name=memory_name)
+    buffers = np.ndarray((2, shape[0] + 2, shape[1] + 2), dtype=np.uint8, buffer=memory.buf)
+    start, end = band
+    rows, columns = end - start, shape[1]
+    try:
+        for generation in range(iterations):
+            source = buffers[generation % 2]
+            # the target still holds the generation before the source one
+            target = buffers[1 - generation % 2, start + 1:end + 1, 1:-1]
+            # same rule as cellular_automaton_step, the padded rows start - 1 and end are the halo
+            neighbour_wall_count = np.zeros((rows, columns), dtype=np.uint8)
+            for j in range(3):
+                for k in range(3):
+                    if j != 1 or k != 1:
+                        neighbour_wall_count += source[start + j:start + j + rows, k:k + columns]
+            new = (neighbour_wall_count > 4).astype(np.uint8)
+            flags[2 * index] = int(np.count_nonzero(new != source[start + 1:end + 1, 1:-1]))
+            flags[2 * index + 1] = int(not np.array_equal(new, target))
+            target[:] = new
+            # wait for every band to be written, then for the main process to decide whether to carry on
+            barrier.wait()
+            barrier.wait()
+            if stop.value:
+                break
+    except threading.BrokenBarrierError:
+        # the main process gave up, e.g. the run was cancelled
+        pass
+    except BaseException:
+        barrier.abort()
+        raise
+    finally:
+        # views of the shared memory have to go before it can be closed
+        source = target = buffers = None
+        memory.close()
+
+
+# runs in every worker: nothing is left to wait for once the main process is gone
+def _exit_with_parent():
+    wait([multiprocessing.parent_process().sentinel])
+    os._exit(1)
+
+# runs in the main process: breaks the barrier as soon as a worker exits with an error or is killed, so the main
+# process and the other workers do not wait at it for ever
+def _watch_workers(processes, barrier, finished):
+    sentinels = {process.sentinel: process for process in processes}
+    while sentinels and not finished.is_set():
+        for sentinel in wait(list(sentinels), timeout=WATCH_SECONDS):
+            # the sentinel is ready as soon as the process is going, its exit code only once it is gone
+            process = sentinels.pop(sentinel)
+            process.join()
+            if process.exitcode:
+                barrier.abort()
+                return
+
+# waits at the barrier in the main process, a broken barrier means one of the workers failed
+def _wait(barrier):
+    try:
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        raise RuntimeError("a cellular automaton worker process failed") from None
+
+
+# steps automaton.map up to iterations times like automaton.run, but band by band across worker processes
+# workers=None uses one process per core. progress(done, iterations) is called after every generation and can raise
+# GenerationCancelled, which leaves the map as it was. Stops early on a fixed point or a 2-cycle, returns the steps taken
+def run_banded(automaton, iterations, workers=None, progress=None):
+    shape = automaton.map.shape
+    band_list = bands(shape[0], workers or os.cpu_count() or 1)
+    memory = shared_memory.SharedMemory(create=True, size=2 * (shape[0] + 2) * (shape[1] + 2))
+    context = multiprocessing.get_context()
+    # the main process waits at the barrier too, so it sees every generation and can stop the workers
+    barrier = context.Barrier(len(band_list) + 1)
+    flags = context.Array("q", 2 * len(band_list), lock=False)
+    stop = context.Value("b", 0, lock=False)
+    buffers = np.ndarray((2, shape[0] + 2, shape[1] + 2), dtype=np.uint8, buffer=memory.buf)
+    processes = []
+    finished = threading.Event()
+    watcher = None
+    try:
+        buffers[:] = 1
+        buffers[0, 1:-1, 1:-1] = automaton.map
+        processes = [context.Process(target=_band_worker, daemon=True,
+                                     args=(memory.name, shape, band, index, iterations, barrier, flags, stop))
+                     for index, band in enumerate(band_list)]
+        for process in processes:
+            process.start()
+        watcher = threading.Thread(target=_watch_workers, args=(processes, barrier, finished), daemon=True)
+        watcher.start()
+
+        # the generation after the last step is in buffers[result]
+        steps, result, converged = iterations, iterations % 2, None
+        for generation in range(iterations):
+            _wait(barrier)
+            done = generation + 1
+            if sum(flags[0::2]) == 0:
+                converged, steps, result = "fixed point", done, done % 2
+            elif generation > 0 and not any(flags[1::2]):
+                # the same map as two generations ago, so it alternates with the one before from now on
+                converged, steps, result = "2-cycle", done, done % 2
+                if (iterations - done) % 2 == 1:
+                    steps, result = done + 1, 1 - done % 2
+            if progress is not None:
+                progress(iterations if converged else done, iterations)
+            stop.value = converged is not None
+            _wait(barrier)
+            if converged is not None:
+                break
+
+        automaton.map[:, :] = buffers[result, 1:-1, 1:-1]
+        automaton.reset_changes()
+        automaton.converged = converged
+    except BaseException:
+        # frees any worker waiting at the barrier, they stop without touching the map again
+        barrier.abort()
+        raise
+    finally:
+        for process in processes:
+            process.join()
+        finished.set()
+        if watcher is not None:
+            watcher.join()
+        buffers = None
+        memory.close()
+        memory.unlink()
+    return steps
@@ -0,0 +1,210 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from cache import HeightmapCache, cached_generate
+from helpers import ALGORITHMS, BINARY_ALGORITHMS, CellularAutomaton, default_config, generate_map
+from instrumentation import instrumentation, log_file_sink, stage, enable_from_environment
+from rendering import save_image
+from store import OutputStore
+from streaming import generate_streamed, save_streamed_image
+
+# headless map generation from a job list, no GUI or display needed
+# run with: python batch.py jobs.json --output Saved/batch
+#
+# the job list is a JSON or YAML list of jobs (or {"jobs": [...]}), each job is a dict like
+#   {"algorithm": "opensimplex", "size": 512, "frequency": 0.02, "amplitude": 128, "seed": 7,
+#    "island": true, "format": "png", "count": 100}
+# algorithm is one of cellular, randomwalk, opensimplex or perlin. size is one number for a square map or [width, height].
+# frequency, amplitude, lacunarity, persistence, fractal_level, octaves, min_wavelength and tolerance are NoiseConfig fields,
+# iterations and density are the cellular automaton settings (workers > 1 steps it across that many processes), walkers, steps and brush the random walk cave's. count generates that many maps with seeds
+# seed, seed+1, ... and a missing seed is drawn at random. format is png, npy (the raw map) or, for the cellular
+# automaton only, gif (an animation of every generation, streamed to disk a frame at a time)
+# "stream": true generates a noise map a strip at a time into a disk-backed .npy instead of memory, for maps
+# too big for RAM (16384 and up). It is never cached, and a png is written from the .npy a strip at a time
+
+FORMATS = ["png", "npy", "gif"]
+# whole number fields of a job and the smallest value each can take, a missing seed or workers is allowed
+INTEGER_FIELDS = {"seed": 0, "count": 1, "iterations": 1, "density": 0, "walkers": 1, "steps": 1, "brush": 0, "workers": 1}
+CONFIG_FIELDS = ["frequency", "amplitude", "lacunarity", "persistence", "fractal_level", "octaves", "min_wavelength", "tolerance"]
+# NoiseConfig fields that can be left as None
+OPTIONAL_CONFIG_FIELDS = ["octaves", "min_wavelength", "tolerance"]
+JOB_FIELDS = ["algorithm", "size", "seed", "island", "format", "count", "name", "iterations", "density", "stream",
+              "walkers", "steps", "brush", "workers"] + CONFIG_FIELDS
+
+
+def load_jobs(path):
+    with open(path) as file:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+            jobs = yaml.safe_load(file)
+        else:
+            jobs = json.load(file)
+    if isinstance(jobs, dict):
+        jobs = jobs.get("jobs")
+    if not isinstance(jobs, list):
+        raise ValueError("job file must contain a list of jobs or a dict with a jobs list")
+    return jobs
+
+# check every job before any map is generated, so a typo in the last job does not waste the whole run
+def check_job(job):
+    if not isinstance(job, dict):
+        raise ValueError(f"job must be a dict, got {job!r}")
+    unknown = set(job) - set(JOB_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown job fields {sorted(unknown)}, expected some of {JOB_FIELDS}")
+    if job.get("algorithm") not in ALGORITHMS:
+        raise ValueError(f"algorithm must be one of {ALGORITHMS}, got {job.get('algorithm')!r}")
+    if job.get("format", "png") not in FORMATS:
+        raise ValueError(f"format must be one of {FORMATS}, got {job.get('format')!r}")
+    if job.get("format") == "gif" and job["algorithm"] != "cellular":
+        raise ValueError("only cellular jobs can be saved as gif")
+    if job.get("stream") and job["algorithm"] in BINARY_ALGORITHMS:
+        raise ValueError("only opensimplex and perlin jobs can be streamed")
+    job_size(job)
+    for field, low in INTEGER_FIELDS.items():
+        value = job.get(field)
+        if value is not None and not (is_integer(value) and value >= low):
+            raise ValueError(f"{field} must be a whole number of at least {low}, got {value!r}")
+    if job.get("density", 0) > 100:
+        raise ValueError(f"density must be at most 100, got {job['density']!r}")
+    for field in ["island", "stream"]:
+        if not isinstance(job.get(field, False), bool):
+            raise ValueError(f"{field} must be true or false, got {job[field]!r}")
+    for field in CONFIG_FIELDS:
+        value = job.get(field)
+        if field in OPTIONAL_CONFIG_FIELDS and value is None:
+            continue
+        if field == "octaves":
+            if not (is_integer(value) and value >= 1):
+                raise ValueError(f"octaves must be a whole number of at least 1, got {value!r}")
+        elif field in job and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise ValueError(f"{field} must be a number, got {value!r}")
+
+# bools are ints in python, but true is not a size
+def is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def job_size(job):
+    size = job.get("size", 256)
+    if is_integer(size) and size > 0:
+        return size, size
+    if isinstance(size, (list, tuple)) and len(size) == 2 and all(is_integer(n) and n > 0 for n in size):
+        return size[0], size[1]
+    raise ValueError(f"size must be a positive whole number or [width, height], got {size!r}")
+
+# NoiseConfig of the job, any field it leaves out keeps the algorithm's default
+def job_config(job):
+    config = default_config(job["algorithm"])
+    for field in CONFIG_FIELDS:
+        if field in job:
+            setattr(config, field, job[field])
+    return config
+
+# keyword arguments of generate_map and cached_generate for one map of a job
+def job_settings(job, config, seed):
+    return dict(config=config, chooseisland=job.get("island", False), seed=seed,
+                iterations=job.get("iterations", 10), density=job.get("density", 60),
+                walkers=job.get("walkers", 16), steps=job.get("steps", 8192), brush=job.get("brush", 1),
+                workers=job.get("workers"))
+
+# generates every map of a job and writes each one to disk as soon as it is done, yields the paths written
+# with a HeightmapCache, maps generated by an earlier run are loaded instead
+# every file is written whole under a temporary name first and recorded with its job settings in the output
+# directory's manifest.jsonl (see store.py), so several batch runs can share an output directory
+def run_job(job, index, output, cache=None):
+    store = OutputStore(output)
+    algorithm = job["algorithm"]
+    map_width, map_height = job_size(job)
+    config = job_config(job)
+    extension = job.get("format", "png")
+    name = job.get("name", f"job{index}_{algorithm}")
+    first_seed = job.get("seed")
+    if first_seed is None:
+        first_seed = int(np.random.default_rng().integers(0, 2**31))
+
+    for n in range(job.get("count", 1)):
+        seed = first_seed + n
+        filename = f"{name}_seed{seed}.{extension}"
+        metadata = {field: value for field, value in job.items() if field not in ["seed", "count"] + CONFIG_FIELDS}
+        metadata.update(algorithm=algorithm, size=[map_width, map_height], seed=seed)
+        if algorithm not in BINARY_ALGORITHMS:
+            metadata["config"] = config
+        if extension == "gif":
+            # every generation is written as it is stepped, so there is no finished map to cache
+            from gifwriter import write_ca_animation
+            ca = CellularAutomaton(np.zeros((map_width, map_height), dtype=np.uint8), job.get("density", 60),
+                                   map_width, map_height, job.get("island", False), seed=seed)
+            ca.noise_grid()
+            with stage("batch.save", format=extension):
+                yield store.put(filename, lambda path: write_ca_animation(ca, job.get("iterations", 10), path), **metadata)
+            continue
+        if job.get("stream"):
+            yield store.put(filename, lambda path: run_streamed(algorithm, map_width, map_height, config,
+                                                                job.get("island", False), seed, path), **metadata)
+            continue
+        settings = job_settings(job, config, seed)
+        start = time.perf_counter()
+        if cache is None:
+            grid = generate_map(algorithm, map_width, map_height, **settings)
+        else:
+            grid = cached_generate(cache, algorithm, map_width, map_height, **settings)
+        metadata["timings"] = {"generate": time.perf_counter() - start}
+        with stage("batch.save", format=extension):
+            if extension == "npy":
+                yield store.put(filename, lambda path: np.save(path, grid), **metadata)
+            else:
+                yield store.put(filename, lambda path: save_image(grid, path, cellular=algorithm in BINARY_ALGORITHMS),
+                                **metadata)
+
+# a map too big for memory goes straight to a .npy memmap, a png is rendered from it and the .npy deleted
+def run_streamed(algorithm, map_width, map_height, config, chooseisland, seed, path):
+    heights_path = os.path.splitext(path)[0] + ".npy"
+    heights = generate_streamed(heights_path, algorithm, map_width, map_height, config=config,
+                                chooseisland=chooseisland, seed=seed)
+    if path != heights_path:
+        save_streamed_image(heights, path)
+        del heights
+        os.remove(heights_path)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate maps from a JSON or YAML job list without the GUI")
+    parser.add_argument("jobs", help="path to the .json, .yaml or .yml job list")
+    parser.add_argument("--output", default=os.path.join("Saved", "batch"), help="directory the maps are written to")
+    parser.add_argument("--cache", help="keep generated maps in this directory and reuse them on later runs")
+    parser.add_argument("--events", help="append a JSON line for every timed stage to this file")
+    parser.add_argument("--metrics", help="write Prometheus text totals of every stage to this file at the end")
+    args = parser.parse_args(argv)
+
+    try:
+        jobs = load_jobs(args.jobs)
+        for job in jobs:
+            check_job(job)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+    os.makedirs(args.output, exist_ok=True)
+    cache = HeightmapCache(args.cache) if args.cache else None
+    enable_from_environment()
+    if args.events:
+        instrumentation.enable(log_file_sink(args.events))
+    if args.metrics:
+        instrumentation.enable()
+
+    total = 0
+    start = time.perf_counter()
+    for index, job in enumerate(jobs):
+        for path in run_job(job, index, args.output, cache):
+            total += 1
+            elapsed = time.perf_counter() - start
+            print(f"{path}  ({total} maps, {total / elapsed:.2f} maps/second)", flush=True)
+    elapsed = time.perf_counter() - start
+    print(f"generated {total} maps in {elapsed:.2f}s, {total / elapsed if elapsed else 0:.2f} maps/second")
+    if args.metrics:
+        instrumentation.write_prometheus(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
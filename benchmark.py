@@ -0,0 +1,264 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+from helpers import OPENSIMPLEX_OCTAVES, CellularAutomaton, NoiseConfig, NoiseGenerator, RandomWalkCave, default_config
+from bands import run_banded
+from rendering import render_terrain, save_image
+
+# times every stage of map generation at every map size, without the GUI
+# run with: python benchmark.py [--sizes 128 256 ...] [--stages opensimplex perlinnoise2 ...] [--legacy]
+# every run is appended to benchmarks.json with the git commit it ran on, so runs before and after a change can be compared
+#
+# each stage is timed --repeat times and the fastest run is kept, then run once more under tracemalloc
+# for its peak memory (numpy allocations included), since tracing slows the stage down
+
+SIZES = [128, 256, 512, 1024, 2048]
+HISTORY = "benchmarks.json"
+
+
+# every stage is set up by a function taking the map size and returning the function to time,
+# so building its input is not part of the measurement
+
+def setup_noise_grid(size):
+    ca = CellularAutomaton(np.zeros((size, size), dtype=np.uint8), 60, size, size, False, seed=1)
+    return ca.noise_grid
+
+def setup_random_circle_gradient(size):
+    ca = CellularAutomaton(np.zeros((size, size), dtype=np.uint8), 60, size, size, False, seed=1)
+    ca.noise_grid()
+    return ca.random_circle_gradient
+
+def setup_cellular_automaton(size):
+    ca = CellularAutomaton(np.zeros((size, size), dtype=np.uint8), 60, size, size, False, seed=1)
+    ca.noise_grid()
+    return ca.cellular_automaton
+
+# 100 iterations, which stop early once the map converges
+def setup_cellular_automaton_run(size):
+    ca = CellularAutomaton(np.zeros((size, size), dtype=np.uint8), 50, size, size, False, seed=1)
+    ca.noise_grid()
+    return lambda: ca.run(100)
+
+# 20 iterations across one process per core
+def setup_cellular_automaton_banded(size):
+    ca = CellularAutomaton(np.zeros((size, size), dtype=np.uint8), 60, size, size, False, seed=1)
+    ca.noise_grid()
+    return lambda: run_banded(ca, 20)
+
+# 16 walkers of 8192 steps each
+def setup_random_walk_cave(size):
+    cave = RandomWalkCave(np.zeros((size, size), dtype=np.uint8), size, size, seed=1)
+    return cave.carve
+
+def noise_generator(size, algorithm="opensimplex"):
+    return NoiseGenerator(np.empty((size, size)), size, size, default_config(algorithm), False, seed=1)
+
+def setup_opensimplex(size):
+    return noise_generator(size).opensimplex
+
+def setup_perlinnoise2(size):
+    return noise_generator(size, "perlin").perlinnoise2
+
+# octaves with features shorter than 2 pixels are skipped
+def setup_opensimplex_culled(size):
+    config = default_config("opensimplex")
+    config.min_wavelength = 2
+    return NoiseGenerator(np.empty((size, size)), size, size, config, False, seed=1).opensimplex
+
+def setup_applyislandgradient(size):
+    generator = noise_generator(size)
+    generator.opensimplex()
+    heights = generator.map
+    def run():
+        generator.map = heights
+        generator.applyislandgradient()
+    return run
+
+def setup_blend_layers(size):
+    generator = noise_generator(size)
+    layers = np.empty((generator.octaves or OPENSIMPLEX_OCTAVES, size, size))
+    generator.opensimplex_region(np.arange(size), np.arange(size), layers=layers)
+    return lambda: generator.blend_layers(layers)
+
+def setup_render(size):
+    heights = noise_generator(size).opensimplex()
+    return lambda: render_terrain(heights)
+
+def setup_save(size):
+    heights = noise_generator(size).opensimplex()
+    path = os.path.join(tempfile.gettempdir(), f"benchmark{size}.png")
+    return lambda: save_image(heights, path)
+
+STAGES = {
+    "noise_grid": setup_noise_grid,
+    "random_circle_gradient": setup_random_circle_gradient,
+    "cellular_automaton": setup_cellular_automaton,
+    "cellular_automaton_run": setup_cellular_automaton_run,
+    "cellular_automaton_banded": setup_cellular_automaton_banded,
+    "random_walk_cave": setup_random_walk_cave,
+    "opensimplex": setup_opensimplex,
+    "perlinnoise2": setup_perlinnoise2,
+    "opensimplex_culled": setup_opensimplex_culled,
+    "applyislandgradient": setup_applyislandgradient,
+    "blend_layers": setup_blend_layers,
+    "render": setup_render,
+    "save": setup_save,
+}
+
+
+def measure(stage, size, repeat):
+    times = []
+    for _ in range(repeat):
+        run = STAGES[stage](size)
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    run = STAGES[stage](size)
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    seconds = min(times)
+    return {"stage": stage, "size": size, "seconds": seconds, "peak_bytes": peak,
+            "pixels_per_second": size * size / seconds if seconds else None}
+
+
+# modules imported by a fresh interpreter on its own, like a batch worker or the GUI starting up
+IMPORT_MODULES = ["helpers", "cache", "tiling", "streaming", "batch", "main"]
+# big libraries that should only be loaded by the modules that draw or save something
+HEAVY_MODULES = ["matplotlib", "PIL", "customtkinter", "tkinter", "multiprocessing", "yaml"]
+
+# seconds to import module in a new python process, the fastest of repeat tries, and which HEAVY_MODULES it loaded
+def measure_import(module, repeat):
+    code = ("import sys, time\n"
+            "start = time.perf_counter()\n"
+            f"import {module}\n"
+            "print(time.perf_counter() - start)\n"
+            f"print(' '.join(name for name in {HEAVY_MODULES!r} if name in sys.modules))")
+    times = []
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__)))
+        if process.returncode != 0:
+            return {"stage": f"import {module}", "error": process.stderr.strip().splitlines()[-1]}
+        seconds, loaded = (process.stdout.splitlines() + [""])[:2]
+        times.append(float(seconds))
+    return {"stage": f"import {module}", "seconds": min(times), "loaded": loaded.split()}
+
+def compare_imports(modules, repeat):
+    results = []
+    print(f"{'module':<12} {'seconds':>10}  heavy modules loaded")
+    for module in modules:
+        result = measure_import(module, repeat)
+        results.append(result)
+        if "error" in result:
+            print(f"{module:<12} {'failed':>10}  {result['error']}", flush=True)
+        else:
+            print(f"{module:<12} {result['seconds']:>10.4f}  {' '.join(result['loaded']) or '-'}", flush=True)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def append_history(path, run):
+    history = []
+    if os.path.exists(path):
+        with open(path) as file:
+            history = json.load(file)
+    history.append(run)
+    with open(path, "w") as file:
+        json.dump(history, file, indent=1)
+
+
+# the perlinnoise2 loop as it was before the vectorised engine, one PerlinNoise call per pixel per octave
+# it is far too slow to run on a whole 2048 map, so --legacy times it on LEGACY_ROWS rows and scales up
+LEGACY_ROWS = 4
+
+def legacy_perlin_rows(config, map_height, rows):
+    from perlin_noise import PerlinNoise
+    noise1 = PerlinNoise(octaves=8)
+    map = np.empty((rows, map_height))
+    for row in range(rows):
+        for column in range(map_height):
+            x = (row) * config.fractal_level
+            y = (column) * config.fractal_level
+            r_frequency = config.frequency
+            r_amplitude = config.amplitude
+            noisevalue = 0
+            for i in range(8):
+                noisevalue += r_amplitude*noise1([x * r_frequency, y * r_frequency])
+                r_frequency *= config.lacunarity
+                r_amplitude *= config.persistence
+            map[row][column] = noisevalue
+    return map
+
+def compare_legacy(sizes):
+    # default Perlin slider positions from main.py
+    config = NoiseConfig(0.005, 32, 2, 0.5, 0.1)
+    print(f"{'size':>6} {'legacy (s)':>12} {'vectorised (s)':>15} {'speedup':>9}")
+    for size in sizes:
+        start = time.perf_counter()
+        legacy_perlin_rows(config, size, LEGACY_ROWS)
+        legacy = (time.perf_counter() - start) * size / LEGACY_ROWS
+        start = time.perf_counter()
+        NoiseGenerator(np.empty((size, size)), size, size, config, False).perlinnoise2()
+        vectorised = time.perf_counter() - start
+        print(f"{size:>6} {legacy:>12.2f} {vectorised:>15.3f} {legacy / vectorised:>8.0f}x")
+    print(f"legacy times are scaled up from {LEGACY_ROWS} rows per size")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time every map generation stage at every map size")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage and size, the fastest is kept")
+    parser.add_argument("--history", default=HISTORY, help="JSON file every run is appended to")
+    parser.add_argument("--legacy", action="store_true", help="compare the Perlin engine with the old per-pixel version instead")
+    parser.add_argument("--imports", nargs="*", metavar="MODULE",
+                        help=f"time importing these modules in a new process instead, {' '.join(IMPORT_MODULES)} if none are given")
+    args = parser.parse_args(argv)
+
+    if args.legacy:
+        compare_legacy(args.sizes)
+        return
+
+    if args.imports is not None:
+        results = compare_imports(args.imports or IMPORT_MODULES, max(args.repeat, 5))
+    else:
+        results = []
+        print(f"{'stage':<24} {'size':>6} {'seconds':>10} {'peak MB':>9} {'Mpixels/s':>10}")
+        for stage in args.stages:
+            for size in args.sizes:
+                result = measure(stage, size, args.repeat)
+                results.append(result)
+                print(f"{stage:<24} {size:>6} {result['seconds']:>10.4f} {result['peak_bytes'] / 2**20:>9.1f} "
+                      f"{result['pixels_per_second'] / 1e6:>10.2f}", flush=True)
+
+    append_history(args.history, {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "results": results,
+    })
+    print(f"appended to {args.history}")
+
+
+if __name__ == "__main__":
+    main()
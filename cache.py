@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from helpers import BINARY_ALGORITHMS, ENGINE_VERSION, NoiseGenerator, default_config, generate_map
+from instrumentation import stage
+
+# in-memory cache of numpy arrays that evicts the least recently used entries once the arrays
+# add up to more than max_bytes. get and put can be called from several threads at once
+class LRUCache:
+    def __init__(self, max_bytes):
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    # returns None if the key is not cached, otherwise marks it as the most recently used
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    # an array bigger than the whole cache is not stored at all
+    def put(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key).nbytes
+            if value.nbytes > self.max_bytes:
+                return
+            self.entries[key] = value
+            self.nbytes += value.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+
+# generated maps kept on disk as .npy files named by a hash of everything that decides their contents,
+# so the same algorithm, settings, size, seed and island choice load the saved map instead of generating it again
+# files are loaded memory mapped, and the least recently used ones are deleted once the directory passes max_bytes
+# the directory is only listed on the first put and when the maps put since then take it over max_bytes, and it is
+# then brought down to EVICT_TO of max_bytes so filling a big cache does not list it again on every put. Maps put by
+# other processes are only counted from the next listing on
+EVICT_TO = 0.9
+
+class HeightmapCache:
+    def __init__(self, directory="Cache", max_bytes=2 * 1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # bytes in the directory at the last listing plus the maps put since, None until the first put
+        self.nbytes = None
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.npy")
+
+    # returns a read only memory mapped array, or None if the map is not cached
+    def get(self, key):
+        path = self.path(key)
+        try:
+            grid = np.load(path, mmap_mode="r")
+        except FileNotFoundError:
+            return None
+        # the modification time doubles as the last used time for eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted by another process since it was loaded
+            return None
+        return grid
+
+    # noise heightmaps are stored as float32, cellular automaton and cave grids keep their uint8
+    @staticmethod
+    def stored(grid):
+        if grid.dtype.kind == "f":
+            return grid.astype(np.float32, copy=False)
+        return grid
+
+    def put(self, key, grid):
+        grid = self.stored(grid)
+        # write to a temporary file first so another process never loads half a map
+        temporary = os.path.join(self.directory, f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(temporary, "wb") as file:
+            np.save(file, grid)
+            size = file.tell()
+        path = self.path(key)
+        try:
+            size -= os.stat(path).st_size
+        except FileNotFoundError:
+            pass
+        os.replace(temporary, path)
+        with self.lock:
+            if self.nbytes is not None:
+                self.nbytes += size
+            if self.nbytes is None or self.nbytes > self.max_bytes:
+                self.evict()
+
+    # once the cache is over max_bytes, delete the least recently used maps until it fits in EVICT_TO of max_bytes
+    def evict(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npy"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        if total > self.max_bytes:
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes * EVICT_TO:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        self.nbytes = total
+
+
+# hash of everything that decides what generate_map returns, used as the HeightmapCache key
+def heightmap_key(algorithm, map_width, map_height, config, seed, chooseisland, iterations=10, density=60,
+                  walkers=16, steps=8192, brush=1):
+    settings = {"algorithm": algorithm, "width": map_width, "height": map_height, "seed": seed,
+                "island": bool(chooseisland), "engine": ENGINE_VERSION}
+    if algorithm == "cellular":
+        settings.update(iterations=iterations, density=density)
+    elif algorithm == "randomwalk":
+        settings.update(walkers=walkers, steps=steps, brush=brush)
+    else:
+        settings["config"] = vars(config)
+    # numpy numbers from sliders or random generators are turned into plain python numbers
+    text = json.dumps(settings, sort_keys=True, default=lambda value: value.item())
+    return hashlib.sha256(text.encode()).hexdigest()
+
+# generate_map, but loading the map from the cache when it has been generated before
+# a missing seed is drawn here so the map can still be cached
+def cached_generate(cache, algorithm, map_width, map_height, config=None, chooseisland=False, seed=None, iterations=10, density=60,
+                    progress=None, walkers=16, steps=8192, brush=1, workers=None):
+    if seed is None:
+        seed = int(np.random.default_rng().integers(0, 2**31))
+    if config is None and algorithm not in BINARY_ALGORITHMS:
+        config = default_config(algorithm)
+    key = heightmap_key(algorithm, map_width, map_height, config, seed, chooseisland, iterations, density, walkers, steps, brush)
+    grid = cache.get(key)
+    if grid is None:
+        grid = generate_map(algorithm, map_width, map_height, config=config, chooseisland=chooseisland,
+                            seed=seed, iterations=iterations, density=density, progress=progress,
+                            walkers=walkers, steps=steps, brush=brush, workers=workers)
+        # the same dtype as a map loaded from the cache, so the result does not depend on whether it was cached
+        grid = cache.stored(grid)
+        cache.put(key, grid)
+    return grid
+
+# key of the octave layers of a noise map in an LRUCache: everything that decides them, which is everything but
+# the amplitude and persistence that only weight the layers (see NoiseGenerator.blend_layers)
+# octaves is the number of octaves evaluated, from NoiseGenerator.octave_plan
+def layer_key(algorithm, map_width, map_height, config, seed, octaves):
+    return (algorithm, int(seed), config.frequency, config.fractal_level, config.lacunarity, map_width, map_height, octaves)
+
+# NoiseGenerator.progressive, but a map that is already cached is yielded straight away as the only pass
+# and a newly finished map is put in the cache
+# layers is an optional LRUCache of octave layers: a map that only differs from one generated before in amplitude or
+# persistence is blended from that map's layers as the only pass, and a newly generated map's layers are kept in it
+# the layers are only kept when they can be used again: not for a map without a seed, which can never be asked for
+# again, nor for layers bigger than the whole LRUCache
+def cached_progressive(cache, algorithm, map_width, map_height, config, chooseisland=False, seed=None, progress=None, layers=None):
+    if seed is None:
+        layers = None
+        seed = int(np.random.default_rng().integers(0, 2**31))
+    key = heightmap_key(algorithm, map_width, map_height, config, seed, chooseisland)
+    grid = cache.get(key)
+    if grid is not None:
+        yield 1, grid
+        return
+    generator = NoiseGenerator(np.empty((map_width, map_height)), map_width, map_height, config, chooseisland,
+                               seed=seed, progress=progress)
+    octave_layers = None
+    if layers is not None:
+        octaves, _ = generator.octave_plan(algorithm)
+        octave_key = layer_key(algorithm, map_width, map_height, config, seed, octaves)
+        octave_layers = layers.get(octave_key)
+        if octave_layers is not None:
+            with stage("blend_layers", algorithm=algorithm):
+                grid = cache.stored(generator.blend_layers(octave_layers))
+            cache.put(key, grid)
+            yield 1, grid
+            return
+        if octaves * map_width * map_height * np.dtype(np.float64).itemsize <= layers.max_bytes:
+            octave_layers = np.empty((octaves, map_width, map_height))
+    for step, grid in generator.progressive(algorithm, layers=octave_layers):
+        if step == 1:
+            # the finished map as it is cached, like the map yielded on a cache hit
+            grid = cache.stored(grid)
+            cache.put(key, grid)
+            if octave_layers is not None:
+                layers.put(octave_key, octave_layers)
+        yield step, grid
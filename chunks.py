@@ -0,0 +1,40 @@
+import numpy as np
+from cache import LRUCache
+from helpers import NoiseGenerator, NOISE_REGIONS
+
+# an unbounded noise world split into square chunks, addressed by chunk coordinates (cx, cy)
+# chunk (cx, cy) covers map rows cx*chunk_size to (cx+1)*chunk_size and the same for columns with cy
+# every chunk is generated from the same seed and world coordinates, so neighbouring chunks join up seamlessly
+# recently used chunks are kept in an LRUCache, so panning back over terrain does not regenerate it
+
+CHUNK_SIZE = 256
+CACHE_BYTES = 256 * 1024 * 1024
+
+
+class ChunkedWorld:
+    def __init__(self, config, algorithm="opensimplex", seed=None, chunk_size=CHUNK_SIZE, cache_bytes=CACHE_BYTES):
+        if algorithm not in NOISE_REGIONS:
+            raise ValueError(f"algorithm must be one of {list(NOISE_REGIONS)}")
+        self.chunk_size = chunk_size
+        self.algorithm = algorithm
+        # the island gradient needs a map edge, so an infinite world never uses it
+        self.generator = NoiseGenerator(None, chunk_size, chunk_size, config, False, seed=seed)
+        self.seed = self.generator.seed
+        self.region = getattr(self.generator, NOISE_REGIONS[algorithm])
+        self.cache = LRUCache(cache_bytes)
+
+    # heights for chunk (cx, cy). lod n samples every 2^n-th pixel of the chunk, so it covers the same
+    # area with a (chunk_size / 2^n) square array. The returned array is shared with the cache, so it is read only
+    def get_chunk(self, cx, cy, lod=0):
+        step = 2**lod
+        if lod < 0 or self.chunk_size % step != 0:
+            raise ValueError(f"lod must be between 0 and log2 of the chunk size {self.chunk_size}")
+        key = (cx, cy, lod)
+        chunk = self.cache.get(key)
+        if chunk is None:
+            rows = cx * self.chunk_size + np.arange(0, self.chunk_size, step)
+            columns = cy * self.chunk_size + np.arange(0, self.chunk_size, step)
+            chunk = self.region(rows, columns)
+            chunk.flags.writeable = False
+            self.cache.put(key, chunk)
+        return chunk
@@ -0,0 +1,89 @@
+import os
+import struct
+import numpy as np
+from PIL import Image
+from PIL.GifImagePlugin import getdata
+from rendering import ca_lut
+
+# writes an animated GIF one frame at a time, straight from grids of palette indices (0 and 1 for the
+# cellular automaton), so only the frame being written is ever in memory however many frames there are
+# the file has one global colour table, and Pillow's GIF encoder compresses each frame on its own
+class GifWriter:
+    # colours is an (n, 3) uint8 array, frame values index into it. duration is milliseconds per frame
+    # and loop is how many times the animation repeats, 0 meaning forever
+    def __init__(self, path, width, height, colours, duration=350, loop=0):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.duration = duration
+        self.frames = 0
+        # written next to the final file and renamed on close, so a half written GIF is never left behind
+        self.temporary = f"{path}.{os.getpid()}.tmp"
+        self.file = open(self.temporary, "wb")
+
+        # the colour table holds 2, 4, 8 ... 256 colours, unused entries are black
+        bits = max(1, int(np.ceil(np.log2(len(colours)))))
+        table = np.zeros((2**bits, 3), dtype=np.uint8)
+        table[:len(colours)] = colours
+        self.file.write(b"GIF89a" + struct.pack("<HHBBB", width, height, 0xF0 | (bits - 1), 0, 0))
+        self.file.write(table.tobytes())
+        # NETSCAPE2.0 application extension that makes the animation loop
+        self.file.write(b"!\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", loop) + b"\x00")
+
+    # frame is a (height, width) array of colour indices, drawn the same way round as imshow
+    def add_frame(self, frame):
+        frame = np.asarray(frame, dtype=np.uint8)
+        if frame.shape != (self.height, self.width):
+            raise ValueError(f"frame must have shape {(self.height, self.width)}, got {frame.shape}")
+        for data in getdata(Image.fromarray(frame, mode="L"), duration=self.duration):
+            self.file.write(data)
+        self.frames += 1
+
+    def close(self):
+        self.file.write(b";")
+        self.file.close()
+        os.replace(self.temporary, self.path)
+
+    # stop without leaving a file, e.g. when the animation was cancelled
+    def discard(self):
+        self.file.close()
+        os.remove(self.temporary)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        if error_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+# steps the automaton once per generation and streams every generation into a GIF at one pixel per cell
+# the first frame is the starting grid, then one frame per iteration. on_frame(grid) is called with every frame
+# as well, so the same frames can be shown on screen without stepping the automaton again, and
+# on_step(done, iterations) after every step, which can raise GenerationCancelled like a progress callback
+# the animation stops early once the automaton has converged: nothing changes after a fixed point, and a 2-cycle
+# gets one more frame if needed so the last frame is still the map after every iteration (see CellularAutomaton.run)
+def write_ca_animation(automaton, iterations, path, duration=350, on_frame=None, on_step=None):
+    with GifWriter(path, automaton.map_height, automaton.map_width, ca_lut(), duration) as writer:
+        def add_frame():
+            frame = automaton.map.copy()
+            writer.add_frame(frame)
+            if on_frame is not None:
+                on_frame(frame)
+
+        add_frame()
+        for i in range(1, iterations + 1):
+            automaton.cellular_automaton()
+            add_frame()
+            if on_step is not None:
+                on_step(i, iterations)
+            if automaton.converged is not None:
+                if automaton.converged == "2-cycle" and (iterations - i) % 2 == 1:
+                    automaton.cellular_automaton()
+                    add_frame()
+                if on_step is not None:
+                    on_step(iterations, iterations)
+                break
+    return path
@@ -1,194 +1,818 @@
+import time
+from functools import lru_cache
 import numpy as np
-from perlin_noise import PerlinNoise
-from opensimplex import noise2, seed, OpenSimplex
+from instrumentation import instrumentation, stage, timer, count
+from masks import apply_mask, circle_cells, island_mask, outside_circle
 
 
+# one generation of the cellular automaton rule on the whole grid at once
+# a cell becomes wall (1) if more than 4 of its 8 Moore neighbours are wall, otherwise land (0)
+# cells outside the map count as wall, so the grid is padded with a border of 1s
+# neighbours are counted by adding the 8 shifted slices of the padded grid instead of looping per cell
+def cellular_automaton_step(grid):
+    width, height = grid.shape
+    padded = np.ones((width + 2, height + 2), dtype=np.uint8)
+    padded[1:-1, 1:-1] = grid
+    neighbour_wall_count = np.zeros((width, height), dtype=np.uint8)
+    for j in range(3):
+        for k in range(3):
+            if j != 1 or k != 1:
+                neighbour_wall_count += padded[j:j + width, k:k + height]
+    return (neighbour_wall_count > 4).astype(np.uint8)
+
+
+# the 3x3 Moore neighbourhood of a cell as (row, column) offsets, the cell itself included
+NEIGHBOURHOOD = np.array([(j, k) for j in (-1, 0, 1) for k in (-1, 0, 1)])
+# the automaton only steps the cells around the last step's changes while those are at most this fraction of the map,
+# and goes back to stepping the whole map once they are more. Evaluating cells one by one costs a lot more per cell
+# than the shifted slices of cellular_automaton_step
+SPARSE_FRACTION = 1 / 64
+
 # uses value noise (just a 0 or 1 grid randomly placed) and cellular automaton to create a terrain
 class CellularAutomaton:
-    def __init__(self, map, density, map_width, map_height, chooseisland):
+    def __init__(self, map, density, map_width, map_height, chooseisland, seed=None):
         self.map = map
         self.density = density
         self.map_width = map_width
         self.map_height = map_height
         self.chooseisland = chooseisland
 
+        # like NoiseGenerator, the noise grid and island circles all come from this seed
+        if seed is None:
+            seed = np.random.default_rng().integers(0, 2**31)
+        self.seed = int(seed)
+        self.random = np.random.default_rng(self.seed)
+        self.reset_changes()
+
+    # forget which cells changed, for when the map is changed other than by stepping the automaton
+    def reset_changes(self):
+        # cells that flipped in the last step and the step before, None until a step has been taken. A boolean mask
+        # the shape of the map while lots of cells change, or sorted flat indices into the map with a border of wall
+        # around it (see sparse_step) once few enough change for the next step to only look at their neighbourhoods
+        self.changed = None
+        self.previous_changed = None
+        # how many cells flipped in those two steps, two steps can only flip the same cells if they flip as many
+        self.changed_count = None
+        self.previous_changed_count = None
+        # the map with a border of wall around it, kept up to date cell by cell by the incremental steps
+        self.padded = None
+        # None while the map is still changing, "fixed point" once a step changes nothing, or "2-cycle" once
+        # a step flips back exactly the cells the step before flipped, so the map alternates between two states
+        self.converged = None
+
     # generate value noise grid (first step)
     def noise_grid(self):
-        random = np.random.default_rng()
-
-        for row in range(self.map_width):
-            for column in range(self.map_height):
-                randomnumber = random.integers(0,100)
-                if (randomnumber > self.density):
-                    self.map[row][column] = 0 # land
-                else:
-                    self.map[row][column] = 1 # water
+        random = self.random
+
+        # draw the whole grid at once, land is 0 and water is 1 like before
+        with stage("ca.noise_grid"):
+            randomnumbers = random.integers(0, 100, size=(self.map_width, self.map_height))
+            self.map[:, :] = randomnumbers <= self.density
         
         if self.chooseisland == True:
             self.map = self.random_circle_gradient()
+        self.reset_changes()
         return self.map
     
+    # one generation of the automaton. After the first few smoothing steps only cells along the land and water
+    # boundaries still flip, so once few cells changed in the last step, only those cells and their neighbours
+    # (the only cells whose neighbourhood changed) are evaluated again, instead of the whole map
     def cellular_automaton(self): #iterate through Moore neighbourhoods
-        copy = np.copy(self.map)
-        for row in range(self.map_width):
-            for column in range(self.map_height):
-                neighbour_wall_count = 0
-                for j in range(row - 1, row + 2):
-                    for k in range(column - 1, column + 2):
-                        if j < 0 or k < 0 or j > self.map_width - 1 or k > self.map_height - 1:
-                            neighbour_wall_count += 1
-                        elif j != row or k != column:
-                            if copy[j][k] == 1:
-                                neighbour_wall_count += 1
-                if neighbour_wall_count > 4:
-                    self.map[row][column] = 1
-                else:
-                    self.map[row][column] = 0
+        with stage("ca.step"):
+            if self.changed is None or self.changed.dtype == bool:
+                new = cellular_automaton_step(self.map)
+                changed = new != self.map
+                self.map[:, :] = new
+                self.padded = None
+                changed_count = int(np.count_nonzero(changed))
+                # few enough changes to step only their neighbourhoods next time
+                if changed_count * 9 <= self.map.size * SPARSE_FRACTION:
+                    changed = self.padded_indices(changed)
+            else:
+                changed = self.sparse_step()
+                changed_count = len(changed)
+                # too many changes again, the next step is cheaper over the whole map
+                if changed_count * 9 > self.map.size * SPARSE_FRACTION:
+                    changed = self.changed_mask(changed)
+            count("ca.cells_changed", changed_count)
+
+        self.previous_changed, self.changed = self.changed, changed
+        self.previous_changed_count, self.changed_count = self.changed_count, changed_count
+        if changed_count == 0:
+            self.converged = "fixed point"
+        elif changed_count == self.previous_changed_count and self.same_changes(changed, self.previous_changed):
+            # every cell is 0 or 1, so flipping the same cells twice gives back the map of two steps ago
+            self.converged = "2-cycle"
         return self.map
+
+    # sorted flat indices into the map with a border of wall around it (see sparse_step) of a mask of changed cells
+    def padded_indices(self, changed):
+        rows, columns = np.divmod(np.flatnonzero(changed), self.map_height)
+        return (rows + 1) * (self.map_height + 2) + columns + 1
+
+    # mask of the map from padded indices, the other way round from padded_indices
+    def changed_mask(self, indices):
+        changed = np.zeros(self.map.shape, dtype=bool)
+        rows, columns = np.divmod(indices, self.map_height + 2)
+        changed[rows - 1, columns - 1] = True
+        return changed
+
+    # whether two steps flipped the same cells, each given as a mask of the map or as padded indices
+    def same_changes(self, changed, previous):
+        if changed.dtype == bool and previous.dtype == bool:
+            return np.array_equal(changed, previous)
+        if changed.dtype == bool:
+            changed = self.padded_indices(changed)
+        if previous.dtype == bool:
+            previous = self.padded_indices(previous)
+        return np.array_equal(changed, previous)
+
+    # the rule applied only to the cells next to the ones that changed in the last step, returns the cells that flipped
+    # cells are flat indices into the map with its border of wall (self.padded), so neighbours are a fixed offset away
+    def sparse_step(self):
+        width, height = self.map.shape
+        if self.padded is None:
+            self.padded = np.ones((width + 2, height + 2), dtype=np.uint8)
+            self.padded[1:-1, 1:-1] = self.map
+        padded = self.padded.ravel()
+        offsets = NEIGHBOURHOOD[:, 0] * (height + 2) + NEIGHBOURHOOD[:, 1]
+
+        # every cell within one step of a changed cell, leaving out the border which never changes
+        candidates = np.unique((self.changed[:, None] + offsets[None, :]).ravel())
+        rows, columns = np.divmod(candidates, height + 2)
+        candidates = candidates[(rows > 0) & (rows <= width) & (columns > 0) & (columns <= height)]
+
+        # same rule as cellular_automaton_step
+        neighbour_wall_count = np.zeros(len(candidates), dtype=np.uint8)
+        for offset in offsets:
+            if offset != 0:
+                neighbour_wall_count += padded.take(candidates + offset)
+        new = (neighbour_wall_count > 4).astype(np.uint8)
+        flipped = candidates[new != padded.take(candidates)]
+
+        padded[flipped] ^= 1
+        rows, columns = np.divmod(flipped, height + 2)
+        # not ^= like the padded copy, the map can be any numeric array, e.g. float64 like the GUI used to pass in
+        self.map[rows - 1, columns - 1] = 1 - self.map[rows - 1, columns - 1]
+        return flipped
+
+    # steps the automaton up to iterations times, stopping early once it has converged. The map is the same as
+    # after all the iterations: a fixed point stays put, and a 2-cycle is stepped once more if an odd number of
+    # iterations were left. progress(done, iterations) is called after every step, returns the steps taken
+    def run(self, iterations, progress=None):
+        for i in range(iterations):
+            self.cellular_automaton()
+            if progress is not None:
+                progress(i + 1, iterations)
+            if self.converged is not None:
+                if self.converged == "2-cycle" and (iterations - i - 1) % 2 == 1:
+                    self.cellular_automaton()
+                    i += 1
+                if progress is not None:
+                    progress(iterations, iterations)
+                return i + 1
+        return iterations
     
     #removes all the outer noise using a big circle
-    #removes 5 random small circles within the central circle in attempt to make a more realistic island
+    #removes 6 random small circles within the central circle in attempt to make a more realistic island
     def random_circle_gradient(self):
-        #numpy random Generator object
-        random = np.random.default_rng()
-
-        centre_x = self.map_width / 2
-        centre_y = self.map_height / 2
-        # circle equation (x-x1)^2 + (y-y1)^2 = 900
-        radius = centre_x * 0.6
-        radius_squared = (radius)**2
-        for x in range(self.map_width):
-            for y in range(self.map_height):
-                tmp = (x - centre_x)**2 + (y - centre_y)**2
-                if tmp >= radius_squared:   # if satisfies inequality x^2 + y^2 >= r^2, change to water a.k.a 1
-                    self.map[x][y] = 1
-        
-        # 5 circles will have radius significantly smaller of main one
-        smaller_radius = int(radius/5)
-        smaller_radius_squared = smaller_radius**2
-        for _ in range(6):
-            # centre of random circles located within big circle (or the square technically encasing it)
-            randomcircle_x = random.integers(centre_x - radius, centre_x + radius)
-            randomcircle_y = random.integers(centre_y - radius, centre_y + radius)
-            for x in range(randomcircle_x - smaller_radius, randomcircle_x + smaller_radius):
-                for y in range(randomcircle_y - smaller_radius, randomcircle_y + smaller_radius):
-                    #check the square encasing the small circles and change to water, or if outside the big circle flip to land randomly to add some variety
-                    tmp2 = (x - randomcircle_x)**2 + (y - randomcircle_y)**2
-                    tmp = (x - centre_x)**2 + (y - centre_y)**2
-                    # if current x and y coordinate are within the smaller circles, change to water
-                    if tmp2 <= smaller_radius_squared:
-                        self.map[x][y] = 1
-                    # if current x and y coordinate are outside big circle
-                    if tmp >= radius_squared:
-                        # re implement land sparsely using inputted density of water
-                        randomnumber = random.integers(0,100)
-                        if (randomnumber > self.density):
-                            self.map[x][y] = 0 
-                        else:
-                            self.map[x][y] = 1
+        with stage("ca.random_circle_gradient"):
+            #numpy random Generator object
+            random = self.random
+
+            centre = np.array([self.map_width / 2, self.map_height / 2])
+            # the circle has to fit both ways on a map that is not square
+            radius = min(centre) * 0.6
+            # everything outside the big circle becomes water a.k.a 1
+            outside = outside_circle(self.map.shape, radius)
+            self.map[outside] = 1
+
+            # the small circles have radius significantly smaller of main one, their centres are located within big
+            # circle (or the square technically encasing it) and all drawn at once
+            smaller_radius = int(radius/5)
+            centres = random.integers(centre - radius, centre + radius, size=(6, 2))
+            rows, columns, inside = circle_cells(centres, smaller_radius)
+            # change everything within the smaller circles to water
+            self.map[rows[inside], columns[inside]] = 1
+            # where the squares around the small circles reach outside the big circle, re implement land sparsely
+            # using inputted density of water to add some variety
+            ring = outside[rows, columns]
+            self.map[rows[ring], columns[ring]] = random.integers(0, 100, size=np.count_nonzero(ring)) <= self.density
+
+        return self.map
+
+
+
+# the four steps a random walker can take, as (row, column) offsets
+WALK_STEPS = np.array([(1, 0), (-1, 0), (0, 1), (0, -1)], dtype=np.int32)
+# cells visited by walkers whose brushes are carved in one scatter, bounds the temporary index arrays
+CARVE_BATCH = 65536
+
+# folds positions on an endless line back onto 0 to n-1, so a walk that leaves the map bounces off its edges
+# (a step towards an edge the walker is standing on becomes a step away from it)
+def reflect(positions, n):
+    if n == 1:
+        return np.zeros_like(positions)
+    period = 2 * (n - 1)
+    positions = np.mod(positions, period)
+    return np.where(positions > n - 1, period - positions, positions)
 
+# offsets of every cell within radius of the brush centre, radius 0 carves only the cell walked on
+def brush_offsets(radius):
+    offsets = np.arange(-radius, radius + 1)
+    rows, columns = np.meshgrid(offsets, offsets, indexing="ij")
+    inside = rows**2 + columns**2 <= radius**2
+    return rows[inside], columns[inside]
+
+# caves and tunnels dug by random walkers, a 0/1 uint8 grid like the cellular automaton: 1 is rock and 0 is tunnel
+# https://gist.github.com/dougmcnally/c8f3cf1b4d0740934ed4b028c4b67276 is the single walker this started from
+# every walker starts in the middle of the map and takes steps random steps up, down, left or right. All the steps
+# of all the walkers are drawn at once and added up with a cumulative sum, instead of one walker stepped in a loop
+class RandomWalkCave:
+    def __init__(self, map, map_width, map_height, walkers=16, steps=8192, brush=1, seed=None):
+        self.map = map
+        self.map_width = map_width
+        self.map_height = map_height
+        self.walkers = walkers
+        self.steps = steps
+        self.brush = brush
+
+        # like CellularAutomaton, every step of every walker comes from this seed
+        if seed is None:
+            seed = np.random.default_rng().integers(0, 2**31)
+        self.seed = int(seed)
+        self.random = np.random.default_rng(self.seed)
+
+    # the path of every walker as (rows, columns) arrays of shape (walkers, steps + 1), starting position included
+    def walk(self):
+        with stage("cave.walk", walkers=self.walkers, steps=self.steps):
+            moves = WALK_STEPS[self.random.integers(0, 4, size=(self.walkers, self.steps))]
+            paths = []
+            for axis, size in enumerate((self.map_width, self.map_height)):
+                path = np.empty((self.walkers, self.steps + 1), dtype=np.int64)
+                path[:, 0] = size // 2
+                np.cumsum(moves[:, :, axis], axis=1, out=path[:, 1:])
+                path[:, 1:] += size // 2
+                paths.append(reflect(path, size))
+        return paths[0], paths[1]
+
+    # fills the map with rock and digs out a tunnel brush cells wide around every walker's path
+    def carve(self):
+        rows, columns = self.walk()
+        with stage("cave.carve"):
+            self.map[:, :] = 1
+            # walkers cross their own and each other's paths a lot, so each cell is only brushed once
+            visited = np.zeros((self.map_width, self.map_height), dtype=bool)
+            visited[rows, columns] = True
+            cells = np.flatnonzero(visited)
+            brush_rows, brush_columns = brush_offsets(self.brush)
+            for start in range(0, len(cells), CARVE_BATCH):
+                cell_rows, cell_columns = np.divmod(cells[start:start + CARVE_BATCH], self.map_height)
+                carved_rows = (cell_rows[:, None] + brush_rows[None, :]).ravel()
+                carved_columns = (cell_columns[:, None] + brush_columns[None, :]).ravel()
+                inside = (carved_rows >= 0) & (carved_rows < self.map_width) & (carved_columns >= 0) & (carved_columns < self.map_height)
+                self.map[carved_rows[inside], carved_columns[inside]] = 0
+            count("cave.cells_walked", len(cells))
         return self.map
 
 
 
+#https://github.com/lmas/opensimplex
+#the 2D OpenSimplex algorithm from the opensimplex package, rewritten to work on whole numpy arrays
+#instead of one coordinate at a time. Same constants, permutation and gradients, so the output matches noise2
+STRETCH_CONSTANT2 = -0.211324865405187    # (1/Math.sqrt(2+1)-1)/2
+SQUISH_CONSTANT2 = 0.366025403784439      # (Math.sqrt(2+1)-1)/2
+NORM_CONSTANT2 = 47
+GRADIENTS2 = np.array([5, 2, 2, 5, -5, 2, -2, 5, 5, -2, 2, -5, -5, -2, -2, -5], dtype=np.int64)
+
+# maps are generated a block of rows at a time, sized so the temporary arrays of the noise kernel stay in cache
+BLOCK_SIZE = 8192
+
+
+# wrap a python int around like a signed 64 bit integer
+def _overflow(x):
+    return (x + 2**63) % 2**64 - 2**63
+
+# permutation table for a seed, generated exactly like OpenSimplex(seed) does
+def opensimplex_permutation(seed):
+    perm = np.zeros(256, dtype=np.int64)
+    source = list(range(256))
+    seed = int(seed)
+    for _ in range(3):
+        seed = _overflow(seed * 6364136223846793005 + 1442695040888963407)
+    for i in range(255, -1, -1):
+        seed = _overflow(seed * 6364136223846793005 + 1442695040888963407)
+        r = (seed + 31) % (i + 1)
+        perm[i] = source[r]
+        source[r] = source[i]
+    return perm
+
+# the gradient picked for lattice point (xsb, ysb) only depends on xsb & 0xFF and ysb & 0xFF,
+# so both gradient components are looked up once for all 256x256 cases and flattened into two tables
+def opensimplex_gradients(perm):
+    xsb = np.arange(256).reshape(-1, 1)
+    ysb = np.arange(256).reshape(1, -1)
+    index = perm[(perm[xsb] + ysb) & 0xFF] & 0x0E
+    return GRADIENTS2[index].astype(np.int8).ravel(), GRADIENTS2[index + 1].astype(np.int8).ravel()
+
+# contribution of the gradient at lattice point (xsb, ysb), only where the attenuation is positive
+def _simplex_contribution(gradients, xsb, ysb, dx, dy):
+    lattice = (xsb & 0xFF) << 8
+    lattice |= ysb & 0xFF
+    extrapolation = gradients[0].take(lattice) * dx
+    extrapolation += gradients[1].take(lattice) * dy
+    attn = 2 - dx * dx
+    attn -= dy * dy
+    np.maximum(attn, 0, out=attn)
+    attn *= attn
+    attn *= attn
+    attn *= extrapolation
+    return attn
+
+# x and y can be any arrays that broadcast together, the result has the broadcast shape
+# gradients come from opensimplex_gradients(perm), so they are only built once per seed
+def opensimplex_noise2(gradients, x, y):
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+
+    # Place input coordinates onto grid.
+    stretch_offset = (x + y) * STRETCH_CONSTANT2
+    xs = x + stretch_offset
+    ys = y + stretch_offset
+
+    # Floor to get grid coordinates of rhombus (stretched square) super-cell origin.
+    xsb = np.floor(xs).astype(np.int32)
+    ysb = np.floor(ys).astype(np.int32)
+
+    # Skew out to get actual coordinates of rhombus origin.
+    squish_offset = (xsb + ysb) * SQUISH_CONSTANT2
+    xb = xsb + squish_offset
+    yb = ysb + squish_offset
+
+    # Compute grid coordinates relative to rhombus origin.
+    xins = xs - xsb
+    yins = ys - ysb
+    in_sum = xins + yins
+
+    # Positions relative to origin point.
+    dx0 = x - xb
+    dy0 = y - yb
+
+    # Contribution (1,0) and (0,1)
+    value = _simplex_contribution(gradients, xsb + 1, ysb + 0, dx0 - 1 - SQUISH_CONSTANT2, dy0 - 0 - SQUISH_CONSTANT2)
+    value += _simplex_contribution(gradients, xsb + 0, ysb + 1, dx0 - 0 - SQUISH_CONSTANT2, dy0 - 1 - SQUISH_CONSTANT2)
+
+    # upper is 1 inside the triangle (2-Simplex) at (1,1) and 0 inside the one at (0,0)
+    upper = (in_sum > 1).astype(np.int8)
+    zins = np.where(upper, 2 - in_sum, 1 - in_sum)
+    # (0,0) is one of the closest two triangular vertices
+    closest = np.where(upper, (zins < xins) | (zins < yins), (zins > xins) | (zins > yins))
+
+    # every branch of the scalar version picks the extra vertex at an offset (i, j) from (xsb, ysb):
+    # (1,-1) or (-1,1) when (0,0) is close and (1,1) otherwise in the lower triangle,
+    # (2,0) or (0,2) when (0,0) is close and (0,0) otherwise in the upper triangle
+    x_bigger = np.where(xins > yins, 1, -1).astype(np.int8)
+    ext_i = np.where(closest, x_bigger + upper, 1 - upper)
+    ext_j = np.where(closest, upper - x_bigger, 1 - upper)
+    # Contribution (0,0) or (1,1)
+    origin_squish = upper * (2 * SQUISH_CONSTANT2)
+    value += _simplex_contribution(gradients, xsb + upper, ysb + upper, dx0 - upper - origin_squish, dy0 - upper - origin_squish)
+
+    # Extra Vertex
+    # the vertex at offset (i, j) sits at dx0 - i - (i + j) * SQUISH, which matches each branch's sum exactly
+    ext_squish = (ext_i + ext_j) * SQUISH_CONSTANT2
+    value += _simplex_contribution(gradients, xsb + ext_i, ysb + ext_j, dx0 - ext_i - ext_squish, dy0 - ext_j - ext_squish)
+
+    return value / NORM_CONSTANT2
+
+
+#https://rtouti.github.io/graphics/perlin-noise-algorithm
+#classic 2D gradient (Perlin) noise on whole numpy arrays. A seeded permutation table picks one of 8 gradients for
+#every lattice point, then the 4 corner dot products are blended with the fade curve 6t^5 - 15t^4 + 10t^3
+DIAGONAL = 1 / np.sqrt(2)
+PERLIN_GRADIENTS = np.array([[1, 0], [-1, 0], [0, 1], [0, -1],
+                             [DIAGONAL, DIAGONAL], [-DIAGONAL, DIAGONAL], [DIAGONAL, -DIAGONAL], [-DIAGONAL, -DIAGONAL]])
+
+# permutation table for a seed, shuffled with numpy so it is the same on every machine
+def perlin_permutation(seed):
+    return np.random.default_rng(int(seed)).permutation(256)
+
+# the gradient for lattice point (xi, yi) only depends on xi & 0xFF and yi & 0xFF, so both components
+# are looked up once for all 256x256 cases and flattened into two tables like opensimplex_gradients
+def perlin_gradients(perm):
+    xi = np.arange(256).reshape(-1, 1)
+    yi = np.arange(256).reshape(1, -1)
+    index = perm[(perm[xi] + yi) & 0xFF] & 0x07
+    return PERLIN_GRADIENTS[index, 0].ravel(), PERLIN_GRADIENTS[index, 1].ravel()
+
+# dot product of the gradient at lattice point (xi, yi) with the offset (dx, dy) to that point
+def _perlin_corner(gradients, xi, yi, dx, dy):
+    lattice = (xi & 0xFF) << 8
+    lattice |= yi & 0xFF
+    value = gradients[0].take(lattice) * dx
+    value += gradients[1].take(lattice) * dy
+    return value
+
+def _fade(t):
+    return t * t * t * (t * (t * 6 - 15) + 10)
+
+# x and y can be any arrays that broadcast together, the result has the broadcast shape
+# gradients come from perlin_gradients(perm), so they are only built once per seed
+def perlin_noise2(gradients, x, y):
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    x_floor = np.floor(x)
+    y_floor = np.floor(y)
+    xi = x_floor.astype(np.int32)
+    yi = y_floor.astype(np.int32)
+    # position inside the unit square
+    xf = x - x_floor
+    yf = y - y_floor
+
+    n00 = _perlin_corner(gradients, xi, yi, xf, yf)
+    n10 = _perlin_corner(gradients, xi + 1, yi, xf - 1, yf)
+    n01 = _perlin_corner(gradients, xi, yi + 1, xf, yf - 1)
+    n11 = _perlin_corner(gradients, xi + 1, yi + 1, xf - 1, yf - 1)
+
+    # interpolate along x, then along y
+    u = _fade(xf)
+    v = _fade(yf)
+    n10 -= n00
+    n10 *= u
+    n00 += n10
+    n11 -= n01
+    n11 *= u
+    n01 += n11
+    n01 -= n00
+    n01 *= v
+    n00 += n01
+    return n00
+
+
+# gradient tables are rebuilt from the permutation, so keep the last few seeds around
+@lru_cache(maxsize=16)
+def _opensimplex_tables(seed):
+    return opensimplex_gradients(opensimplex_permutation(seed))
+
+@lru_cache(maxsize=16)
+def _perlin_tables(seed):
+    return perlin_gradients(perlin_permutation(seed))
+
+# number of octaves each algorithm stacks when NoiseConfig.octaves is left as None
+OPENSIMPLEX_OCTAVES = 10
+PERLIN_OCTAVES = 8
+# the old PerlinNoise(octaves=8) object did not stack octaves, it scaled every coordinate by 8
+# (8 lattice cells per unit), so this is kept as a plain coordinate scale to give the same feature size
+PERLIN_CELLS = 8
+
+# min_wavelength and tolerance turn on octave culling (see NoiseGenerator.octave_plan), both None evaluates every octave
+# min_wavelength skips the octaves whose features are shorter than that many pixels, 2 being the sampling limit below
+# which an octave only adds aliasing. tolerance skips the highest octaves as long as all the skipped octaves together
+# can change no height by more than tolerance
 class NoiseConfig:
-    def __init__(self, frequency, amplitude, lacunarity, persistence, fractal_level):
+    def __init__(self, frequency, amplitude, lacunarity, persistence, fractal_level, octaves=None,
+                 min_wavelength=None, tolerance=None):
         self.frequency = frequency
         self.amplitude = amplitude
         self.lacunarity = lacunarity
         self.persistence = persistence
         self.fractal_level = fractal_level
+        self.octaves = octaves
+        self.min_wavelength = min_wavelength
+        self.tolerance = tolerance
+
+# sampling steps of the passes NoiseGenerator.progressive makes, from 1/8 scale up to the full map
+PREVIEW_STEPS = (8, 4, 2, 1)
+
+# raised by a progress function to stop a generator, the map is left unfinished
+class GenerationCancelled(Exception):
+    pass
+
+# the NoiseGenerator method that fills a region of the map for each noise algorithm
+NOISE_REGIONS = {"opensimplex": "opensimplex_region", "perlin": "perlin_region"}
+# neither noise function ever returns a value outside -1 to 1 (OpenSimplex stays within about 0.87, Perlin 0.71)
+NOISE_BOUND = 1.0
+# octaves of each noise algorithm when NoiseConfig.octaves is None
+DEFAULT_OCTAVES = {"opensimplex": OPENSIMPLEX_OCTAVES, "perlin": PERLIN_OCTAVES}
 
 class NoiseGenerator:
-    def __init__(self, map, map_width, map_height, config, chooseisland):
+    # progress is an optional function called as progress(rows done, total rows) after every block of rows,
+    # it can raise GenerationCancelled to stop the generator part way through
+    # island_kind is the masks.MASK_KINDS shape of the island, when chooseisland is set
+    def __init__(self, map, map_width, map_height, config, chooseisland, seed=None, progress=None, island_kind="square"):
         self.map = map
         self.map_width = map_width
         self.map_height = map_height
+        self.config = config
         self.frequency = config.frequency
         self.amplitude = config.amplitude
         self.lacunarity = config.lacunarity
         self.persistence = config.persistence
         self.fractal_level = config.fractal_level
+        self.octaves = config.octaves
+        self.min_wavelength = getattr(config, "min_wavelength", None)
+        self.tolerance = getattr(config, "tolerance", None)
         self.chooseisland = chooseisland
+        self.island_kind = island_kind
+        self.progress = progress
+
+        # every random value the generator uses is drawn from this seed, so the same seed always gives the same map
+        # and any part of the map can be generated again on its own
+        if seed is None:
+            seed = np.random.default_rng().integers(0, 2**31)
+        self.seed = int(seed)
+        random = np.random.default_rng(self.seed)
+        #offset values added to each octave shift the entire pattern every octave
+        #this makes noise less predictable and less uniform, which is more realistic of real terrain
+        #many features would be replicated in different places
+        #I've tried applying a newly generated offset for every of the 10 octaves and for each coordinate, but it's too chaotic. Maybe could be added gradually
+        #each octave should build on each layer of noise to create natural textures.
+        self.offset_x = random.integers(-99999,99999)
+        self.offset_y = random.integers(-99999,99999)
+        self.noise_seed = random.integers(0,99999)
 
     # if islandchoice = True, apply this gradient after noise has been applied
     def applyislandgradient(self):
-        gradient = np.zeros_like(self.map)
-        centre_x = int(self.map_width / 2)
-        centre_y = int(self.map_height / 2)
-        endofgradient_x = int(self.map_width / 2)
-     
-        colour_change = 1 / endofgradient_x
-        for i in range(endofgradient_x):
-            #square gradient that gets gradually weaker from the centre
-            #each iteration reduces the number to set the next ring
-            gradient[centre_x - i, centre_x-i : centre_x+i+1] = 1 - (colour_change * i )
-            gradient[centre_x + i, centre_x-i : centre_x+i+1] = 1 - (colour_change * i )
-
-            gradient[centre_y-i : centre_y+i+1, centre_y + i] = 1 - (colour_change * i )
-            gradient[centre_y-i : centre_y+i+1, centre_y - i] = 1 - (colour_change * i )
-
-        normalised = (self.map-np.min(self.map)) / (np.max(self.map)-np.min(self.map)) #make opensimplex noise between 0-1, for mask to apply properly
-        self.map = normalised * gradient #take element by element multiplication
+        with stage("island_gradient"):
+            #make noise between 0-1 for mask to apply properly, then take element by element multiplication
+            self.map = apply_mask(self.map, self.island_gradient())
         return self.map
-    
+
+    # the mask multiplied onto the map to make an island, a square gradient unless island_kind is changed
+    def island_gradient(self):
+        return island_mask((self.map_width, self.map_height), self.island_kind)
+
+    # (octaves evaluated, error bound) for the algorithm, every octave unless the config turns on culling
+    # octave i has features about 1 / (frequency * lacunarity**i * scale) pixels long, where scale is how many noise
+    # lattice cells one pixel is at frequency 1, and adds at most amplitude * persistence**i * NOISE_BOUND to a height
+    # only the highest octaves are ever skipped, so the error bound is the sum of the skipped octaves' largest
+    # contributions: no height differs from the one with every octave by more than that
+    # the plan is also kept in self.octaves_evaluated, self.octaves_total and self.error_bound
+    def octave_plan(self, algorithm):
+        total = self.octaves or DEFAULT_OCTAVES[algorithm]
+        scale = self.fractal_level * (PERLIN_CELLS if algorithm == "perlin" else 1)
+        evaluated = total
+        if self.min_wavelength is not None:
+            frequency = self.frequency * scale
+            for i in range(total):
+                if frequency > 0 and 1 / frequency < self.min_wavelength:
+                    evaluated = i
+                    break
+                frequency *= self.lacunarity
+        bounds = []
+        amplitude = self.amplitude
+        for i in range(total):
+            bounds.append(abs(amplitude) * NOISE_BOUND)
+            amplitude *= self.persistence
+        if self.tolerance is not None:
+            while evaluated > 0 and sum(bounds[evaluated - 1:]) <= self.tolerance:
+                evaluated -= 1
+        self.octaves_evaluated, self.octaves_total = evaluated, total
+        self.error_bound = sum(bounds[evaluated:])
+        return evaluated, self.error_bound
+
+    # yields (step, map) for passes of the same map at increasing resolution: the first samples every 8th row and
+    # column, the next every 4th, and so on down to every pixel. Every pass uses the same world coordinates, so it is
+    # a smaller version of the final map, and each pass reuses the samples of the one before it
+    # the last pass is the finished map, stored in self.map just like opensimplex() or perlinnoise2()
+    # layers, if given, is an (octaves, map_width, map_height) array that is filled with the octaves of the finished map
+    def progressive(self, algorithm, steps=PREVIEW_STEPS, layers=None):
+        region = getattr(self, NOISE_REGIONS[algorithm])
+        # every pass reports its own rows, progress gets the pixels of all the passes together instead so it only
+        # goes from 0 to the total once
+        progress = self.progress
+        calls = []
+        previous_step = None
+        for step in steps:
+            rows, columns = len(range(0, self.map_width, step)), len(range(0, self.map_height, step))
+            if previous_step == 2 * step:
+                calls += [rows // 2 * columns, (rows + 1) // 2 * (columns // 2)]
+            else:
+                calls.append(rows * columns)
+            previous_step = step
+        total, done = sum(calls), 0
+
+        def sample(rows, columns, out, layers):
+            nonlocal done
+            if not len(rows) or not len(columns):
+                return
+            before = done
+            if progress is not None:
+                self.progress = lambda rows_done, _: progress(before + rows_done * len(columns), total)
+            try:
+                region(rows, columns, out=out, layers=layers)
+            finally:
+                self.progress = progress
+            done = before + len(rows) * len(columns)
+
+        previous, previous_step = None, None
+        previous_layers = None
+        for step in steps:
+            rows = np.arange(0, self.map_width, step)
+            columns = np.arange(0, self.map_height, step)
+            out = self.map if step == 1 else np.empty((len(rows), len(columns)))
+            pass_layers = None
+            if layers is not None:
+                pass_layers = layers if step == 1 else np.empty((layers.shape[0], len(rows), len(columns)))
+            if previous_step == 2 * step:
+                # the previous pass already has every other row and column of this one
+                out[::2, ::2] = previous
+                if pass_layers is not None:
+                    pass_layers[:, ::2, ::2] = previous_layers
+                sample(rows[1::2], columns, out[1::2], None if pass_layers is None else pass_layers[:, 1::2])
+                sample(rows[::2], columns[1::2], out[::2, 1::2],
+                       None if pass_layers is None else pass_layers[:, ::2, 1::2])
+            else:
+                sample(rows, columns, out, pass_layers)
+            previous, previous_step = out, step
+            previous_layers = pass_layers
+
+            if self.chooseisland == True:
+                preview = apply_mask(out, self.island_gradient()[::step, ::step])
+            else:
+                preview = out
+            if step == 1:
+                self.map = preview
+            yield step, preview
+
+    # the map from octave layers filled in by progressive or a region method, each weighted by the amplitude and
+    # persistence of this generator. Layers only depend on the seed, frequency, fractal level, lacunarity, size and
+    # number of octaves, so a map that only has a different amplitude or persistence is a new sum of the same layers
+    def blend_layers(self, layers):
+        noisevalue = np.empty(layers.shape[1:])
+        # a block of rows at a time, so the sum being built stays in cache while every layer is added to it
+        block_rows = max(1, BLOCK_SIZE // layers.shape[2])
+        weighted = np.empty((block_rows, layers.shape[2]))
+        for start in range(0, layers.shape[1], block_rows):
+            block = noisevalue[start:start + block_rows]
+            block[:] = 0
+            block_weighted = weighted[:block.shape[0]]
+            r_amplitude = self.amplitude
+            # same order of operations as the region methods, so the blend gives exactly the same map
+            for layer in layers[:, start:start + block_rows]:
+                np.multiply(layer, r_amplitude, out=block_weighted)
+                block += block_weighted
+                r_amplitude *= self.persistence
+        self.map = noisevalue
+        if self.chooseisland == True:
+            self.map = self.applyislandgradient()
+        return self.map
+
     #https://github.com/lmas/opensimplex
     #openSimplex noise is another gradient noise pattern
     def opensimplex(self):
-        #offset values added to each octave shift the entire pattern every octave
-        #this makes noise less predictable and less uniform, which is more realistic of real terrain
-        #many features would be replicated in different places
-        #I've tried applying a newly generated offset for every of the 10 octaves and for each coordinate, but it's too chaotic. Maybe could be added gradually
-        #each octave should build on each layer of noise to create natural textures.
-        random = np.random.default_rng()
-        offset_x = random.integers(-99999,99999)
-        offset_y = random.integers(-99999,99999)
-        seed = random.integers(0,99999)
-        noise = OpenSimplex(seed=seed)
-        for row in range(self.map_width):
-            for column in range(self.map_height):
-        
-                noisevalue = 0
-                r_frequency = self.frequency
-                r_amplitude = self.amplitude
-                #apply 10 octaves of simplex noise, doubling the frequency and halving the amplitude on each octave
-                for i in range(10):
-                    x = row * r_frequency * self.fractal_level + offset_x #4000
-                    y = column * r_frequency * self.fractal_level + offset_y #5674
-                    noisevalue += noise.noise2(x,y) * r_amplitude
-                    r_frequency *= self.lacunarity
-                    r_amplitude *= self.persistence
-                self.map[row][column] = noisevalue
+        with stage("opensimplex"):
+            self.opensimplex_region(np.arange(self.map_width), np.arange(self.map_height), out=self.map)
 
         # if you want to make it look like an island, apply this square gradient to remove outer noise.
         if self.chooseisland == True:
             self.map = self.applyislandgradient()
 
         return self.map
+
+    # opensimplex heights (without the island gradient) for the given map rows and columns, both 1D arrays
+    # each element only depends on its own row and column, so a region is identical to the same part of a whole map
+    # layers, if given, is an (octaves, rows, columns) array that is filled with every octave before it is weighted
+    def opensimplex_region(self, rows, columns, out=None, layers=None):
+        gradients = _opensimplex_tables(self.noise_seed)
+        rows = np.asarray(rows).reshape(-1, 1)
+        columns = np.asarray(columns).reshape(1, -1)
+        if out is None:
+            out = np.empty((rows.shape[0], columns.shape[1]))
+        #every octave is evaluated for a whole block of rows at once instead of pixel by pixel
+        block_rows = max(1, BLOCK_SIZE // columns.shape[1])
+        octaves, _ = self.octave_plan("opensimplex")
+        # time spent on each octave summed over every block, only measured while instrumentation is on
+        octave_seconds = [0.0] * octaves if instrumentation.enabled else None
+        for start in range(0, rows.shape[0], block_rows):
+            block = rows[start:start + block_rows]
+            noisevalue = np.zeros((block.shape[0], columns.shape[1]))
+            r_frequency = self.frequency
+            r_amplitude = self.amplitude
+            #apply 10 octaves of simplex noise, doubling the frequency and halving the amplitude on each octave
+            for i in range(octaves):
+                if octave_seconds is not None:
+                    octave_start = time.perf_counter()
+                x = block * r_frequency * self.fractal_level + self.offset_x #4000
+                y = columns * r_frequency * self.fractal_level + self.offset_y #5674
+                layer = opensimplex_noise2(gradients, x, y)
+                if layers is not None:
+                    layers[i, start:start + block_rows] = layer
+                noisevalue += layer * r_amplitude
+                r_frequency *= self.lacunarity
+                r_amplitude *= self.persistence
+                if octave_seconds is not None:
+                    octave_seconds[i] += time.perf_counter() - octave_start
+            out[start:start + block_rows] = noisevalue
+            if self.progress is not None:
+                self.progress(start + block.shape[0], rows.shape[0])
+        if octave_seconds is not None:
+            for i, seconds in enumerate(octave_seconds):
+                timer("opensimplex.octave", seconds, octave=i)
+        count("opensimplex.pixels", out.size)
+        count("opensimplex.octaves_evaluated", octaves)
+        count("opensimplex.octaves_skipped", self.octaves_total - octaves)
+        return out
     
     #https://rtouti.github.io/graphics/perlin-noise-algorithm
     #Explains how adding octaves of noise, increasing frequency and decreasing amplitude on every octave gives noisy terrain (less smooth)
     #octaves are multiple iterations of perlin noise in each sub rectangle
     def perlinnoise2(self):
-        noise1 = PerlinNoise(octaves=8)
-        for row in range(self.map_width):
-            for column in range(self.map_height):
-                #multiplying by 0.25 (default of fractal_level) is necessary to achieve a satisfactory "zoom in" level
-                #due to how the Perlin noise gradient grid works, you essentially feed smaller input values closer to 0
-                #this reduces the FREQUENCY of noise, so you get more smoother and broader features (less like a satellite map)
-                x = (row) * self.fractal_level
-                y = (column) * self.fractal_level
-                r_frequency = self.frequency
-                r_amplitude = self.amplitude
-                noisevalue = 0          
-                for i in range(8):
-                    noisevalue += r_amplitude*noise1([x * r_frequency, y * r_frequency])
-                    r_frequency *= self.lacunarity
-                    r_amplitude *= self.persistence
-                self.map[row][column] = noisevalue
+        with stage("perlin"):
+            self.perlin_region(np.arange(self.map_width), np.arange(self.map_height), out=self.map)
 
         if self.chooseisland == True:
             self.map = self.applyislandgradient()
         
         return self.map
+
+    # perlin heights (without the island gradient) for the given map rows and columns, like opensimplex_region
+    def perlin_region(self, rows, columns, out=None, layers=None):
+        gradients = _perlin_tables(self.noise_seed)
+        rows = np.asarray(rows).reshape(-1, 1)
+        columns = np.asarray(columns).reshape(1, -1)
+        if out is None:
+            out = np.empty((rows.shape[0], columns.shape[1]))
+        block_rows = max(1, BLOCK_SIZE // columns.shape[1])
+        octaves, _ = self.octave_plan("perlin")
+        # time spent on each octave summed over every block, only measured while instrumentation is on
+        octave_seconds = [0.0] * octaves if instrumentation.enabled else None
+        for start in range(0, rows.shape[0], block_rows):
+            block = rows[start:start + block_rows]
+            #multiplying by 0.25 (default of fractal_level) is necessary to achieve a satisfactory "zoom in" level
+            #due to how the Perlin noise gradient grid works, you essentially feed smaller input values closer to 0
+            #this reduces the FREQUENCY of noise, so you get more smoother and broader features (less like a satellite map)
+            x = block * self.fractal_level * PERLIN_CELLS
+            y = columns * self.fractal_level * PERLIN_CELLS
+            r_frequency = self.frequency
+            r_amplitude = self.amplitude
+            noisevalue = np.zeros((block.shape[0], columns.shape[1]))
+            #stack the octaves explicitly, 8 by default
+            for i in range(octaves):
+                if octave_seconds is not None:
+                    octave_start = time.perf_counter()
+                layer = perlin_noise2(gradients, x * r_frequency, y * r_frequency)
+                if layers is not None:
+                    layers[i, start:start + block_rows] = layer
+                noisevalue += r_amplitude * layer
+                r_frequency *= self.lacunarity
+                r_amplitude *= self.persistence
+                if octave_seconds is not None:
+                    octave_seconds[i] += time.perf_counter() - octave_start
+            out[start:start + block_rows] = noisevalue
+            if self.progress is not None:
+                self.progress(start + block.shape[0], rows.shape[0])
+        if octave_seconds is not None:
+            for i, seconds in enumerate(octave_seconds):
+                timer("perlin.octave", seconds, octave=i)
+        count("perlin.pixels", out.size)
+        count("perlin.octaves_evaluated", octaves)
+        count("perlin.octaves_skipped", self.octaves_total - octaves)
+        return out
     
+
+
+# bump whenever a change makes the generators give different maps for the same settings and seed,
+# so heightmaps cached by an older version are not used again
+ENGINE_VERSION = 2
+
+# names of the algorithms generate_map understands
+ALGORITHMS = ["cellular", "randomwalk", "opensimplex", "perlin"]
+# algorithms that make 0/1 uint8 grids rather than heightmaps
+BINARY_ALGORITHMS = ["cellular", "randomwalk"]
+
+# NoiseConfig used when a noise map is generated without one, roughly the middle of the GUI sliders
+def default_config(algorithm):
+    if algorithm == "perlin":
+        return NoiseConfig(0.02, 128, 2, 0.5, 0.25)
+    return NoiseConfig(0.02, 128, 2, 0.5, 1.0)
+
+# generate one finished map without the GUI: a 0/1 uint8 grid for the cellular automaton after all its
+# iterations or for the random walk cave, or the float heightmap for the noise algorithms
+# progress works like NoiseGenerator's, counting rows for noise and iterations for the cellular automaton
+# walkers, steps and brush are the RandomWalkCave settings, the cave has no island
+# workers steps the cellular automaton across that many processes with run_banded, the map is the same either way
+def generate_map(algorithm, map_width, map_height, config=None, chooseisland=False, seed=None, iterations=10, density=60,
+                 progress=None, walkers=16, steps=8192, brush=1, workers=None):
+    if algorithm == "randomwalk":
+        cave = RandomWalkCave(np.zeros((map_width, map_height), dtype=np.uint8), map_width, map_height,
+                              walkers, steps, brush, seed=seed)
+        return cave.carve()
+    if algorithm == "cellular":
+        grid = np.zeros((map_width, map_height), dtype=np.uint8)
+        ca = CellularAutomaton(grid, density, map_width, map_height, chooseisland, seed=seed)
+        ca.noise_grid()
+        if workers is not None and workers > 1:
+            # multiprocessing is only imported when it is used
+            from bands import run_banded
+            run_banded(ca, iterations, workers, progress)
+        else:
+            ca.run(iterations, progress)
+        return ca.map
+    if algorithm not in NOISE_REGIONS:
+        raise ValueError(f"algorithm must be one of {ALGORITHMS}")
+    if config is None:
+        config = default_config(algorithm)
+    generator = NoiseGenerator(np.empty((map_width, map_height)), map_width, map_height, config, chooseisland,
+                               seed=seed, progress=progress)
+    if algorithm == "opensimplex":
+        return generator.opensimplex()
+    return generator.perlinnoise2()
@@ -0,0 +1,135 @@
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# timers and counters around the stages of map generation, turned off by default
+# once enabled, every finished stage and every count is sent to each sink as a dict like
+#   {"type": "timer", "name": "opensimplex.octave", "seconds": 0.12, "time": 1712345678.9, "octave": 3}
+#   {"type": "counter", "name": "opensimplex.pixels", "value": 65536, "time": 1712345678.9}
+# a sink is any function taking the event, log_file_sink writes them to a JSON lines file, and
+# prometheus_text() sums everything seen so far in the Prometheus text format
+# while disabled, stage() hands back one shared do-nothing context manager and count() returns straight away
+
+# nothing to time, shared by every disabled stage()
+_disabled_stage = nullcontext()
+
+
+class Instrumentation:
+    def __init__(self):
+        self.enabled = False
+        self.sinks = []
+        # (name, labels) -> [number of times, total seconds] for timers and total value for counters
+        self.timers = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def enable(self, *sinks):
+        self.sinks.extend(sinks)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        self.sinks = []
+
+    def reset(self):
+        with self.lock:
+            self.timers.clear()
+            self.counters.clear()
+
+    # with stage("name", label=value): times the block when enabled
+    def stage(self, name, **labels):
+        if not self.enabled:
+            return _disabled_stage
+        return self._timed_stage(name, labels)
+
+    @contextmanager
+    def _timed_stage(self, name, labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timer(name, time.perf_counter() - start, **labels)
+
+    # record a time measured somewhere else, e.g. summed over many blocks of rows
+    def timer(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            totals = self.timers.setdefault(key, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+        self.emit({"type": "timer", "name": name, "seconds": seconds, "time": time.time(), **labels})
+
+    def count(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self.emit({"type": "counter", "name": name, "value": value, "time": time.time(), **labels})
+
+    def emit(self, event):
+        for sink in self.sinks:
+            sink(event)
+
+    # totals so far in the Prometheus text exposition format
+    def prometheus_text(self):
+        lines = ["# TYPE terrain_stage_seconds_total counter",
+                 "# TYPE terrain_stage_calls_total counter"]
+        with self.lock:
+            timers = sorted(self.timers.items())
+            counters = sorted(self.counters.items())
+        for (name, labels), (calls, seconds) in timers:
+            series = _prometheus_labels(stage=name, **dict(labels))
+            lines.append(f"terrain_stage_seconds_total{series} {seconds}")
+            lines.append(f"terrain_stage_calls_total{series} {calls}")
+        lines.append("# TYPE terrain_count_total counter")
+        for (name, labels), value in counters:
+            lines.append(f"terrain_count_total{_prometheus_labels(name=name, **dict(labels))} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        with open(path, "w") as file:
+            file.write(self.prometheus_text())
+
+
+# label values escaped as the Prometheus text format needs
+def _prometheus_labels(**labels):
+    text = ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return "{" + text + "}"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# sink that appends every event to a JSON lines file
+def log_file_sink(path):
+    file = open(path, "a", buffering=1)
+    lock = threading.Lock()
+    def sink(event):
+        with lock:
+            # numpy numbers in the labels or values are written as plain numbers
+            file.write(json.dumps(event, default=lambda value: value.item()) + "\n")
+    return sink
+
+
+# the instrumentation the generators, GUI and batch generator report to
+instrumentation = Instrumentation()
+stage = instrumentation.stage
+timer = instrumentation.timer
+count = instrumentation.count
+
+# turn instrumentation on from environment variables, for runs that cannot be changed in code:
+# TERRAIN_EVENTS=path appends every event to that JSON lines file,
+# TERRAIN_METRICS=path writes the Prometheus text totals there when the program exits
+def enable_from_environment():
+    events = os.environ.get("TERRAIN_EVENTS")
+    metrics = os.environ.get("TERRAIN_METRICS")
+    if events:
+        instrumentation.enable(log_file_sink(events))
+    if metrics:
+        instrumentation.enable()
+        atexit.register(instrumentation.write_prometheus, metrics)
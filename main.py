@@ -1,33 +1,30 @@
 import customtkinter
 import tkinter as tk
 import numpy as np
-import matplotlib.pyplot as plt
 import os
+import queue
+import threading
+import time
+from types import SimpleNamespace
 from CTkToolTip import *
 from PIL import Image
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from matplotlib.animation import FuncAnimation
-from matplotlib.colors import ListedColormap, LinearSegmentedColormap
-from filename import next_filename
 from helpers import *
-
-# colours from https://medium.com/@travall/procedural-2d-island-generation-noise-functions-13976bddeaf9
-colors = {
-    "grass": '#7b9c50',
-    "water": '#0952c7',
-    "deepocean": '#003eaf',
-    "dirt": [114,98,49],
-    "sand": '#c2b282',
-    "wetsand": '#a49661',
-    "darkforest": '#3c6216',
-    "verydarkforest": [40,77,0],
-    "forest": "#5A7F33",
-    "mountain": "#8E907B",
-    "highmountain": "#9EA18E",
-    "snow": "white"
-}
-
+from cache import HeightmapCache, LRUCache, cached_progressive
+from rendering import render_ca, render_terrain, save_image
+from gifwriter import write_ca_animation
+from store import OutputStore
+from instrumentation import stage, enable_from_environment
+
+# milliseconds between checks on a map being generated in the background
+POLL_INTERVAL = 50
+# milliseconds each generation of the cellular automaton is shown for, on the canvas and in the saved GIF
+ANIMATION_INTERVAL = 350
+# previews waiting to be drawn before the background thread has to wait for the canvas
+PREVIEW_QUEUE = 2
+# memory kept for the octave layers of recent noise maps, see App.layers
+LAYER_CACHE_BYTES = 512 * 2**20
 
 # frame where map is drawn
 class CanvasFrame(customtkinter.CTkFrame):
@@ -79,7 +76,7 @@ class MainFrame(customtkinter.CTkFrame):
 
         # toggle method of drawing map, and whether to generate an island
         self.combobox_var = customtkinter.StringVar(value="Algorithm")
-        self.combobox = customtkinter.CTkComboBox(self, values=["Basic cellular automaton", "OpenSimplex noise", "Perlin noise"],
+        self.combobox = customtkinter.CTkComboBox(self, values=["Basic cellular automaton", "Random walk cave", "OpenSimplex noise", "Perlin noise"],
                                             command=self.combobox_callback, variable=self.combobox_var, width=300, justify='center')
         self.combobox_var.set("Algorithm")
         self.combobox.grid(row=4, column=0,pady=40)
@@ -87,6 +84,15 @@ class MainFrame(customtkinter.CTkFrame):
         self.islandchoice = customtkinter.CTkSwitch(self, text="Generate island")
         self.islandchoice.grid(row=6, column=0, columnspan=2, pady=10)
 
+        # the same seed and settings always give the same map, leave it blank for a random map
+        self.seed_entry = customtkinter.CTkEntry(self, placeholder_text="Seed (blank for random)", width=200, justify='center')
+        self.seed_entry.grid(row=7, column=0, columnspan=2, pady=5)
+
+        # how far the map being generated has got
+        self.progressbar = customtkinter.CTkProgressBar(self, width=200)
+        self.progressbar.grid(row=8, column=0, columnspan=2, pady=5)
+        self.progressbar.set(0)
+
 class CellularAutomatonSettings(customtkinter.CTkFrame):
     def __init__(self, master, iterations_settings, density_settings, slider_value, **kwargs):
 
@@ -131,6 +137,54 @@ class CellularAutomatonSettings(customtkinter.CTkFrame):
         self.t = CTkToolTip(self.density_slider, message="Density of water in map. Quite a sensitive setting, 60 is nice")
 
 
+class RandomWalkSettings(customtkinter.CTkFrame):
+    def __init__(self, master, walkers_settings, steps_settings, brush_settings, slider_value, **kwargs):
+
+        # type check and length check all arguments
+        if not isinstance(walkers_settings, tuple) or len(walkers_settings) != 3:
+            raise ValueError("walkers_settings must be a tuple of length 3: start, end, increment")
+        if not isinstance(steps_settings, tuple) or len(steps_settings) != 3:
+            raise ValueError("steps_settings must be a tuple of length 3: start, end, increment")
+        if not isinstance(brush_settings, tuple) or len(brush_settings) != 3:
+            raise ValueError("brush_settings must be a tuple of length 3: start, end, increment")
+
+        super().__init__(master, **kwargs)
+
+        self.slider_value = slider_value
+
+        # number of steps of each slider from its start, end and increment
+        walkers_steps = (walkers_settings[1] - walkers_settings[0]) / walkers_settings[2]
+        steps_steps = (steps_settings[1] - steps_settings[0]) / steps_settings[2]
+        brush_steps = (brush_settings[1] - brush_settings[0]) / brush_settings[2]
+
+        # create all widgets for the random walk
+        self.walkers_label = customtkinter.CTkLabel(self, text="Walkers")
+        self.walkers_slider = customtkinter.CTkSlider(self, from_=walkers_settings[0], to=walkers_settings[1], number_of_steps=walkers_steps, command=lambda val:self.slider_value(val, self.walkers_value))
+        self.walkers_value = customtkinter.CTkLabel(self, text="Value: ")
+        self.steps_label = customtkinter.CTkLabel(self, text="Steps per walker")
+        self.steps_slider = customtkinter.CTkSlider(self, from_=steps_settings[0], to=steps_settings[1], number_of_steps=steps_steps, command=lambda val:self.slider_value(val, self.steps_value))
+        self.steps_value = customtkinter.CTkLabel(self, text="Value: ")
+        self.brush_label = customtkinter.CTkLabel(self, text="Tunnel width")
+        self.brush_slider = customtkinter.CTkSlider(self, from_=brush_settings[0], to=brush_settings[1], number_of_steps=brush_steps, command=lambda val:self.slider_value(val, self.brush_value))
+        self.brush_value = customtkinter.CTkLabel(self, text="Value: ")
+
+        self.walkers_label.grid(row=0, column=0)
+        self.walkers_slider.grid(row=1, column=0)
+        self.walkers_value.grid(row=2, column=0)
+        self.steps_label.grid(row=0, column=1)
+        self.steps_slider.grid(row=1, column=1)
+        self.steps_value.grid(row=2, column=1)
+        self.brush_label.grid(row=3, column=0, columnspan=2)
+        self.brush_slider.grid(row=4, column=0, columnspan=2)
+        self.brush_value.grid(row=5, column=0, columnspan=2)
+
+        self.walkers_slider.set(16)
+        self.steps_slider.set(8192)
+        self.brush_slider.set(1)
+
+        self.t = CTkToolTip(self.brush_slider, message="Radius of the tunnel dug around each walker's path, 0 digs a single cell")
+
+
 class NoiseSettings(customtkinter.CTkFrame):
     # all 3 settings are passed as tuples containing the start value, end value, and desired increment
     def __init__(self, master, freq_settings, amp_settings, fractaliser_settings, slider_value, **kwargs):
@@ -182,6 +236,9 @@ class NoiseSettings(customtkinter.CTkFrame):
         self.fractaliser.grid(row=4, column=0, columnspan=2)
         self.fractaliser_value = customtkinter.CTkLabel(self, text="Level: ")
         self.fractaliser_value.grid(row=5, column=0, columnspan=2)
+        # skip the octaves too fine to show up at one pixel per cell, see NoiseGenerator.octave_plan
+        self.cullswitch = customtkinter.CTkSwitch(self, text="Skip sub-pixel octaves")
+        self.cullswitch.grid(row=6, column=0, columnspan=2, pady=5)
         self.t1=CTkToolTip(self.fractaliser, message="How chaotic should it be? Low is less chaotic to high is more chaotic.", delay=0)
         self.t2=CTkToolTip(self.freq_slider, message="Frequency is essentially how often the noise function repeats in a given space. A higher frequency creates more detailed fractal terrain, while lower frequency gives zoomed in and broader terrain")
 
@@ -212,52 +269,76 @@ class App(customtkinter.CTk):
                                    plot=self.plot)
         self.settingsframe.grid(row=0,column=0,padx=15,pady=15, sticky="ew")
 
+        # noise heightmaps are kept on disk, so plotting the same settings and seed again loads instead of regenerating
+        self.cache = HeightmapCache("Cache")
+        # octave layers of the last maps plotted, so moving only the amplitude re-blends them instead of generating
+        # again. One 2048 x 2048 OpenSimplex map has 10 layers of 32 MB
+        self.layers = LRUCache(LAYER_CACHE_BYTES)
+        # (layer settings, amplitude, seed) of the last plot, see seed
+        self.last_seed = (None, None, None)
+        # numbered maps and animations in Saved/, with their settings in Saved/manifest.jsonl
+        self.store = OutputStore("Saved")
+        # seconds the last finished job took on the background thread, saved with its map
+        self.job_seconds = None
+        # map currently being generated in the background, see start_job
+        self.job = None
+        # image of the animation on the canvas, replaced frame by frame, see plotframe
+        self.ca_image = None
+
 
         ##### framelist containing all individual settings frames embedded in main settings frame ###############
+        # a frame is only built the first time its algorithm is picked (see settings), so the window opens without
+        # laying out sliders nobody has asked for yet
         self.framelist = {}
 
-        ##### cellular automaton settings sliders ##########
-
         """
         All settings passed must be tuples of length 3 in format (start, end, increment per step)
         """
-        
-        self.ca_frame = CellularAutomatonSettings(master=self.settingsframe,
-                                                  iterations_settings=(1, 20, 1),
-                                                  density_settings=(0, 100, 1),
+        self.frame_factories = {
+            ##### cellular automaton settings sliders ##########
+            'Basic cellular automaton': lambda: CellularAutomatonSettings(master=self.settingsframe,
+                                                                          iterations_settings=(1, 20, 1),
+                                                                          density_settings=(0, 100, 1),
+                                                                          slider_value=self.slider_value,
+                                                                          width=350,
+                                                                          height=400),
+            ######## random walk cave settings ################
+            'Random walk cave': lambda: RandomWalkSettings(master=self.settingsframe,
+                                                           walkers_settings=(1, 64, 1),
+                                                           steps_settings=(1024, 65536, 1024),
+                                                           brush_settings=(0, 5, 1),
+                                                           slider_value=self.slider_value,
+                                                           width=350,
+                                                           height=400),
+            ######## simplex noise sttings ################
+            'OpenSimplex noise': lambda: NoiseSettings(master=self.settingsframe,
+                                                       freq_settings=(0.005, 0.05, 0.005),
+                                                       amp_settings=(32, 256, 32),
+                                                       fractaliser_settings=(0.5, 1.5, 0.25),
+                                                       slider_value=self.slider_value,
+                                                       width=350,
+                                                       height=400),
+            ######################perlin noise###############################
+            'Perlin noise': lambda: NoiseSettings(master=self.settingsframe,
+                                                  freq_settings=(0.005, 0.05, 0.005),
+                                                  amp_settings=(32, 256, 32),
+                                                  fractaliser_settings=(0.1, 0.6, 0.05),
                                                   slider_value=self.slider_value,
-                                                  width=350, 
-                                                  height=400)
-        self.framelist['Basic cellular automaton'] = self.ca_frame
-
-
-        ######## simplex noise sttings ################
-        self.simplexframe = NoiseSettings(master=self.settingsframe,
-                                        freq_settings=(0.005, 0.05, 0.005),
-                                        amp_settings=(32, 256, 32), 
-                                        fractaliser_settings=(0.5, 1.5, 0.25), 
-                                        slider_value=self.slider_value,
-                                        width=350, 
-                                        height=400)
-        self.framelist['OpenSimplex noise'] = self.simplexframe
-        
-
-
-        ######################perlin noise###############################
-        self.perlinframe = NoiseSettings(master=self.settingsframe,
-                                        freq_settings=(0.005, 0.05, 0.005),
-                                        amp_settings=(32, 256, 32),
-                                        fractaliser_settings=(0.1, 0.6, 0.05),
-                                        slider_value=self.slider_value,
-                                        width=350,
-                                        height=400)
-        self.framelist['Perlin noise'] = self.perlinframe
-        
-        #self.fractaliser_perlin.set(0.25)
-       
-        ########## stack settings frames on top of each other ################
-        for frames in self.framelist.values():
-            frames.grid(row=5, column=0, sticky='nsew')
+                                                  width=350,
+                                                  height=400),
+        }
+
+        # the Perlin frame was always the one on top before an algorithm is picked, so it is the only one built now
+        self.settings('Perlin noise')
+
+    # the settings frame of an algorithm, built and stacked with the others the first time it is asked for
+    def settings(self, choice):
+        if choice not in self.framelist:
+            frame = self.frame_factories[choice]()
+            ########## stack settings frames on top of each other ################
+            frame.grid(row=5, column=0, sticky='nsew')
+            self.framelist[choice] = frame
+        return self.framelist[choice]
 
     ############ UPDATING SLIDERS #################
     def slider_value(self, val, label):
@@ -266,97 +347,256 @@ class App(customtkinter.CTk):
     ############ update which settings frame to show based on combobox ##############
     def combobox_callback(self, choice):
         print("combobox dropdown clicked:", choice)
-        self.framelist[choice].tkraise()
+        self.cancel_job()
+        self.settings(choice).tkraise()
 
     ########### get all values needed for algorithms and save files ##################
+    # generation runs on a background thread (see start_job), plotting and saving happen back on the Tk thread
     def plot(self):
+        # a new plot replaces whatever is still being generated
+        self.cancel_job()
         map_height = int(self.settingsframe.dimensions_slider.get())
         map_width = int(self.settingsframe.dimensions_slider.get())
-        map = np.empty((map_width, map_height), dtype=float)
         option = self.settingsframe.combobox.get()
+        chooseisland = self.settingsframe.islandchoice.get()
         if option == 'Basic cellular automaton':
-            iterations = int(self.ca_frame.iterations_slider.get())
-            density = int(self.ca_frame.density_slider.get())
+            frame = self.settings(option)
+            iterations = int(frame.iterations_slider.get())
+            density = int(frame.density_slider.get())
+            # the automaton only stores 0 or 1 per cell, so a uint8 grid is 8x smaller than the float map
+            grid = np.zeros((map_width, map_height), dtype=np.uint8)
             #create cellular automaton object with empty map primed up
-            ca = CellularAutomaton(map, density, map_width, map_height, self.settingsframe.islandchoice.get())
-            grid = ca.noise_grid()  # modify object to have value noise grid (grid is unused variable)
-            animation = self.createanimation(ca, iterations)
-
-            newfilename = next_filename("map", ".gif")
-            animation.save(filename=f"Saved/{newfilename}", writer="pillow")
+            seed = self.seed()
+            ca = CellularAutomaton(grid, density, map_width, map_height, chooseisland, seed=seed)
+            settings = dict(algorithm="cellular", size=[map_width, map_height], seed=seed, island=bool(chooseisland),
+                            iterations=iterations, density=density)
+            # fill the grid with value noise, then step it on the background thread, streaming every generation into
+            # the GIF and showing the same frames on the canvas one per ANIMATION_INTERVAL
+            self.ca_image = None
+            self.start_job(lambda progress, preview: self.saveanimation(ca, iterations, progress, preview, settings),
+                           lambda path: None, show=self.plotframe, interval=ANIMATION_INTERVAL)
+
+        elif option == 'Random walk cave':
+            frame = self.settings(option)
+            walkers = int(frame.walkers_slider.get())
+            steps = int(frame.steps_slider.get())
+            brush = int(frame.brush_slider.get())
+            seed = self.seed()
+            # a cave is quick to dig, so it is not worth a progress bar, only the thread keeps the window responsive
+            self.start_job(lambda progress, preview: generate_map("randomwalk", map_width, map_height, seed=seed,
+                                                                   walkers=walkers, steps=steps, brush=brush),
+                           lambda cave: self.savecave(cave, algorithm="randomwalk", size=[map_width, map_height], seed=seed,
+                                                      walkers=walkers, steps=steps, brush=brush))
 
         elif option == 'OpenSimplex noise':
-            freq = self.simplexframe.freq_slider.get()
-            amp = self.simplexframe.amp_slider.get()
-            fractalLevel = self.simplexframe.fractaliser.get()
+            frame = self.settings(option)
+            freq = frame.freq_slider.get()
+            amp = frame.amp_slider.get()
+            fractalLevel = frame.fractaliser.get()
             # create a NoiseConfig object containing all settings neeeded for noise algorithm
-            config = NoiseConfig(freq, amp, 2, 0.5, fractalLevel)
-            # NoiseGenerator sets up an object to create terrain
-            emptymap = NoiseGenerator(map, map_width, map_height, config, self.settingsframe.islandchoice.get())
-            island = emptymap.opensimplex()
-            self.plotmap(island)
-
-            #save filenames in incrementing order
-            newfilename = next_filename("simplex", ".png")
-            self.canvasframe.fig.savefig(f"Saved/{newfilename}", bbox_inches="tight")
+            config = NoiseConfig(freq, amp, 2, 0.5, fractalLevel, min_wavelength=2 if frame.cullswitch.get() else None)
+            seed = self.seed(("opensimplex", map_width, map_height, freq, fractalLevel, config.min_wavelength), amp)
+            # generate the terrain, or load it from the cache if these settings and seed were plotted before
+            self.start_job(lambda progress, preview: self.generatemap("opensimplex", map_width, map_height, config, chooseisland, seed, progress, preview),
+                           lambda island: self.savemap(island, "simplex", algorithm="opensimplex", size=[map_width, map_height],
+                                                       seed=seed, island=bool(chooseisland), config=config),
+                           shape=(map_width, map_height))
         
         elif option == 'Perlin noise':
-            freq = self.perlinframe.freq_slider.get()
-            amp = self.perlinframe.amp_slider.get()
-            fractalLevel = self.perlinframe.fractaliser.get()
-            config = NoiseConfig(freq, amp, 2, 0.5, fractalLevel)
-            emptymap = NoiseGenerator(map, map_width, map_height, config, self.settingsframe.islandchoice.get())
-            island = emptymap.perlinnoise2()
-            self.plotmap(island)
-            newfilename = next_filename("perlin", ".png")
-            self.canvasframe.fig.savefig(f"Saved/{newfilename}", bbox_inches="tight")
-
-
-    # uses this colour map to plot the OpenSimplex and Perlin noise maps   
-    def plotmap(self, grid):
-
+            frame = self.settings(option)
+            freq = frame.freq_slider.get()
+            amp = frame.amp_slider.get()
+            fractalLevel = frame.fractaliser.get()
+            config = NoiseConfig(freq, amp, 2, 0.5, fractalLevel, min_wavelength=2 if frame.cullswitch.get() else None)
+            seed = self.seed(("perlin", map_width, map_height, freq, fractalLevel, config.min_wavelength), amp)
+            self.start_job(lambda progress, preview: self.generatemap("perlin", map_width, map_height, config, chooseisland, seed, progress, preview),
+                           lambda island: self.savemap(island, "perlin", algorithm="perlin", size=[map_width, map_height],
+                                                       seed=seed, island=bool(chooseisland), config=config),
+                           shape=(map_width, map_height))
+
+    # runs on the background thread: generates the map a pass at a time from 1/8 scale upwards, sending every
+    # pass before the last one to the canvas as a preview so a rough map shows up straight away
+    def generatemap(self, algorithm, map_width, map_height, config, chooseisland, seed, progress, preview):
+        with stage("plot.generate", algorithm=algorithm):
+            for step, grid in cached_progressive(self.cache, algorithm, map_width, map_height, config,
+                                                 chooseisland=chooseisland, seed=seed, progress=progress,
+                                                 layers=self.layers):
+                if step != 1:
+                    preview(grid)
+        return grid
+
+    # plot a finished noise map and save it in incrementing order, settings are recorded with it in the manifest
+    # the file is written straight from the map at one pixel per cell, not from the figure
+    def savemap(self, island, base_name, **settings):
+        self.plotmap(island)
+        with stage("plot.save"):
+            self.store.save(base_name, ".png", lambda path: save_image(island, path),
+                            timings={"generate": self.job_seconds}, **settings)
+
+    # show a finished cave like a frame of the cellular automaton and save it in incrementing order
+    def savecave(self, cave, **settings):
+        self.ca_image = None
+        self.plotframe(cave)
+        with stage("plot.save"):
+            self.store.save("cave", ".png", lambda path: save_image(cave, path, cellular=True),
+                            timings={"generate": self.job_seconds}, **settings)
+
+    # runs on the background thread: each generation is written to the GIF as soon as it is stepped, so memory
+    # stays at one frame however many iterations there are. The automaton is stepped while the file is written,
+    # so the save time in the manifest is the generation time too. The progress bar counts the iterations
+    def saveanimation(self, ca, iterations, progress, preview, settings):
+        ca.noise_grid()
+        with stage("plot.save_animation"):
+            return self.store.save("map", ".gif", lambda path: write_ca_animation(ca, iterations, path, duration=ANIMATION_INTERVAL,
+                                                                                  on_frame=preview, on_step=progress), **settings)
+
+    ############ BACKGROUND GENERATION #################
+    # runs work(progress, preview) on a background thread so the window keeps responding while a map is generated
+    # work can call preview(map) to have a rough version of the map, or a frame of an animation, drawn before it is finished
+    # progress and the result come back through a queue that poll_job reads from the Tk event loop with after,
+    # because Tk and the Matplotlib canvas can only be used from the main thread
+    # previews go through a small queue of their own, so a worker that runs ahead of the canvas waits instead of
+    # piling frames up in memory. show(grid) draws one, at most one every interval milliseconds (0 draws the newest)
+    # finished(result) is called on the main thread once every preview is drawn, unless the job was cancelled first
+    def start_job(self, work, finished, shape=None, show=None, interval=0):
+        job = SimpleNamespace(cancelled=threading.Event(), queue=queue.Queue(), previews=queue.Queue(maxsize=PREVIEW_QUEUE),
+                              shape=shape, show=show, interval=interval / 1000, next_frame=0, done=False, result=None,
+                              seconds=None)
+        if job.show is None:
+            job.show = lambda grid: self.plotmap(grid, job.shape)
+        self.job = job
+
+        def progress(done, total):
+            if job.cancelled.is_set():
+                raise GenerationCancelled()
+            job.queue.put(("progress", done / total))
+
+        def preview(grid):
+            while True:
+                if job.cancelled.is_set():
+                    raise GenerationCancelled()
+                try:
+                    job.previews.put(grid, timeout=POLL_INTERVAL / 1000)
+                    return
+                except queue.Full:
+                    pass
+
+        def run():
+            start = time.perf_counter()
+            try:
+                result = work(progress, preview)
+            except GenerationCancelled:
+                return
+            except Exception as error:
+                job.queue.put(("error", error))
+                return
+            job.seconds = time.perf_counter() - start
+            job.queue.put(("done", result))
+
+        self.settingsframe.progressbar.set(0)
+        threading.Thread(target=run, daemon=True).start()
+        self.after(POLL_INTERVAL, self.poll_job, job, finished)
+
+    def poll_job(self, job, finished):
+        if job.cancelled.is_set():
+            return
+        while not job.queue.empty():
+            message, value = job.queue.get()
+            if message == "progress":
+                self.settingsframe.progressbar.set(value)
+            elif message == "error":
+                self.job = None
+                raise value
+            else:
+                job.done = True
+                job.result = value
+
+        if job.interval == 0:
+            # only the newest preview is worth drawing, older ones are already out of date
+            grid = None
+            while not job.previews.empty():
+                grid = job.previews.get()
+            if grid is not None:
+                job.show(grid)
+        elif not job.previews.empty() and time.monotonic() >= job.next_frame:
+            job.show(job.previews.get())
+            job.next_frame = time.monotonic() + job.interval
+
+        if job.done and job.previews.empty():
+            self.job = None
+            self.settingsframe.progressbar.set(1)
+            self.job_seconds = job.seconds
+            finished(job.result)
+            return
+        self.after(POLL_INTERVAL, self.poll_job, job, finished)
+
+    # stop the job in progress, its generator stops at the next block of rows and its result is never shown
+    def cancel_job(self):
+        if self.job is not None:
+            self.job.cancelled.set()
+            self.job = None
+
+    # seed typed into the seed box, or a new random one if it is blank
+    # with the seed box empty every plot draws a new seed, except a noise map that only differs from the last one in
+    # its amplitude: it keeps the last seed so the octave layers of the last map can be blended again
+    # layer_settings is everything but the amplitude that decides the layers of a noise map, amplitude the amplitude
+    def seed(self, layer_settings=None, amplitude=None):
+        text = self.settingsframe.seed_entry.get().strip()
+        if text.isdigit():
+            return int(text)
+        last_settings, last_amplitude, last_seed = self.last_seed
+        if layer_settings is not None and layer_settings == last_settings and amplitude != last_amplitude:
+            seed = last_seed
+        else:
+            seed = int(np.random.default_rng().integers(0, 2**31))
+        self.last_seed = (layer_settings, amplitude, seed)
+        return seed
+
+
+    # uses the terrain colours to plot the OpenSimplex and Perlin noise maps
+    # shape is the size of the full map, so a smaller preview is stretched over the same area as the finished map
+    def plotmap(self, grid, shape=None):
+        if shape is None:
+            shape = grid.shape
+
+        # remove the previous map or preview instead of stacking images on the axes
+        self.canvasframe.axes.clear()
         self.canvasframe.axes.set_axis_off()
 
-        colours = [(0, colors["deepocean"]), 
-                (0.37, colors["water"]), 
-                (0.46,colors["sand"]), 
-                (0.47, colors["wetsand"]), 
-                (0.56, colors["grass"]),
-                (0.59, colors["forest"]),
-                (0.64,colors["darkforest"]),
-                (0.80,colors["mountain"]), 
-                (0.85,colors["highmountain"]), 
-                (1,colors["snow"])]
-        colourmap = LinearSegmentedColormap.from_list('colourmap',colours, 256)
-        #colourmap = colourmap(np.array([0, 0.5,0.53,0.56,0.7,0.73,0.87,1]))
+        # coloured with the same lookup table as the saved image
+        with stage("plot.render"):
+            image = render_terrain(grid)
 
         #places map on canvasframe
-        self.canvasframe.axes.imshow(grid, cmap=colourmap, interpolation="bilinear") 
-        self.canvasframe.canvas.draw()
+        with stage("plot.imshow"):
+            self.canvasframe.axes.imshow(image, interpolation="bilinear",
+                                         extent=(-0.5, shape[1] - 0.5, shape[0] - 0.5, -0.5))
+        with stage("plot.draw"):
+            self.canvasframe.canvas.draw()
 
     def openimages(self):
         path = r"Saved"
         os.startfile(path)
 
     ################ CELLULAR AUTOMATON #######################
-    
-    #automaton is an object plotting. It contains the actual map, methods to generate the value noise grid, and apply the cellular automaton
-    def createanimation(self, automaton, totalframes):
-
-        cmap = ListedColormap(["lawngreen","royalblue"])
-        #fig.colorbar(plt.cm.ScalarMappable(cmap=cmap), label='Colours', shrink=0.5, ax=axes)
-        im = self.canvasframe.axes.imshow(automaton.map, cmap=cmap)
-        def animate(i, automaton):
-
-            map = automaton.cellular_automaton()    #creates a map using cellular automata
-            im.set_array(map)
-            self.canvasframe.canvas.draw()   #UPDATE CANVAS PER ANIMATION WITHIN EVENT LOOP. matplotlib canvas has no automatic redraw upon update
-            return [im]
-        animation = FuncAnimation(self.canvasframe.fig, animate, frames=totalframes, interval=350, repeat=False, fargs=[automaton], blit=True)  # fargs is additional arguments
 
-        return animation
+    # draws one generation of the automaton, the first frame of an animation sets up the image and later ones only replace its pixels
+    def plotframe(self, grid):
+        with stage("plot.render"):
+            image = render_ca(grid)
+        if self.ca_image is None:
+            self.canvasframe.axes.clear()
+            self.canvasframe.axes.set_axis_off()
+            self.ca_image = self.canvasframe.axes.imshow(image)
+        else:
+            self.ca_image.set_data(image)
+        with stage("plot.draw"):
+            self.canvasframe.canvas.draw()
 
 # begin the app when running
-customtkinter.set_appearance_mode("dark")
-app = App()
-app.mainloop()
\ No newline at end of file
+if __name__ == "__main__":
+    # TERRAIN_EVENTS / TERRAIN_METRICS turn on the stage timers, see instrumentation.py
+    enable_from_environment()
+    customtkinter.set_appearance_mode("dark")
+    app = App()
+    app.mainloop()
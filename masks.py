@@ -0,0 +1,87 @@
+from functools import lru_cache
+import numpy as np
+
+# island masks are arrays the size of the map, 1 in the middle falling to 0 at the edges, that are multiplied
+# onto a height map so the land is surrounded by water. They are built in closed form from every cell's distance
+# to the centre with broadcasting, and cached because the same map size is plotted again and again
+# cached arrays are read-only, copy one before changing it
+MASK_KINDS = ["square", "radial"]
+
+
+# distance of every row (or column) of an axis of n cells from the centre cell int(n/2), as a fraction of the
+# distance to the edge. Cells the centre cell is more than int(n/2) away from count as exactly 1
+def _axis_distance(n):
+    centre = int(n / 2)
+    offsets = np.abs(np.arange(n) - centre)
+    # (1 / centre) * offset rather than offset / centre gives the same floats as the old ring-by-ring gradient
+    distance = (1 / max(centre, 1)) * offsets
+    distance[offsets >= centre] = 1
+    return distance
+
+# distance of every cell from the centre of a map of this shape, 0 at the centre and 1 at the middle of each edge
+# square uses the larger of the two axis distances, so equal distances form squares, radial the straight line distance
+@lru_cache(8)
+def distance(shape, kind="square"):
+    result = _distance(_axis_distance(shape[0])[:, None], _axis_distance(shape[1])[None, :], kind)
+    result.flags.writeable = False
+    return result
+
+def _distance(rows, columns, kind):
+    if kind == "square":
+        return np.maximum(rows, columns)
+    if kind == "radial":
+        return np.hypot(rows, columns)
+    raise ValueError(f"kind must be one of {MASK_KINDS}, got {kind!r}")
+
+# the default falloff, the mask drops in a straight line from 1 at the centre to 0 at distance 1
+def linear(distance):
+    return np.maximum(1 - distance, 0)
+
+# mask for a map of this shape. falloff turns the distances into mask values and can be any function of a numpy
+# array, e.g. lambda d: np.clip(1 - d**2, 0, 1) keeps more of the middle as land. Masks are cached by shape, kind
+# and falloff, so pass the same function object each time rather than a new lambda
+@lru_cache(8)
+def island_mask(shape, kind="square", falloff=linear):
+    mask = np.asarray(falloff(distance(shape, kind)), dtype=np.float64)
+    if mask.shape != tuple(shape):
+        raise ValueError(f"falloff must return an array of shape {tuple(shape)}, got {mask.shape}")
+    mask.flags.writeable = False
+    return mask
+
+# the rows start to stop of island_mask(shape, kind, falloff), built without the rest of the mask so a map
+# too big for memory can be masked a strip at a time. Not cached, every strip is only needed once
+def mask_rows(shape, start, stop, kind="square", falloff=linear):
+    rows = _axis_distance(shape[0])[start:stop, None]
+    return np.asarray(falloff(_distance(rows, _axis_distance(shape[1])[None, :], kind)), dtype=np.float64)
+
+# multiplies a height map, scaled to 0-1 first, by the mask. Returns a new array and leaves heights unchanged
+# low and high default to the map's own range, pass the whole map's range when heights is one strip of it
+def apply_mask(heights, mask, low=None, high=None):
+    if low is None:
+        low = np.min(heights)
+    if high is None:
+        high = np.max(heights)
+    result = heights - low
+    result /= high - low
+    result *= mask
+    return result
+
+# cells at or beyond radius from the middle of the map, (map_width / 2, map_height / 2)
+@lru_cache(8)
+def outside_circle(shape, radius):
+    rows = (np.arange(shape[0]) - shape[0] / 2)[:, None]
+    columns = (np.arange(shape[1]) - shape[1] / 2)[None, :]
+    outside = rows**2 + columns**2 >= radius**2
+    outside.flags.writeable = False
+    return outside
+
+# every cell of the 2*radius square around each of the (n, 2) centres, as (rows, columns) index arrays of shape
+# (n, 2*radius, 2*radius), and which of those cells are within radius of their centre
+# all the circles are covered by one broadcast, so they can be carved out of a grid with a single assignment
+def circle_cells(centres, radius):
+    centres = np.asarray(centres, dtype=np.intp)
+    offsets = np.arange(-radius, radius)
+    rows, columns = np.broadcast_arrays(centres[:, 0, None, None] + offsets[None, :, None],
+                                        centres[:, 1, None, None] + offsets[None, None, :])
+    inside = offsets[:, None]**2 + offsets[None, :]**2 <= radius**2
+    return rows, columns, np.broadcast_to(inside, rows.shape)
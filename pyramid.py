@@ -0,0 +1,179 @@
+import argparse
+import math
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from instrumentation import count, stage
+from rendering import render_ca, render_terrain
+from streaming import strip, strip_range
+
+# exports a map as a pyramid of z/x/y.png tiles for slippy map viewers like Leaflet or OpenLayers
+# the most zoomed in level has one pixel per cell, and every level above it is the one below shrunk by 2 in each
+# direction (the mean of every 2 x 2 block of heights), down to level 0 which fits in a single tile. Each level
+# is read a strip of tile rows at a time, so a memmapped map from streaming.generate_streamed never has to fit in
+# memory, and the next level is built from the same strip while it is read. Levels too big to keep in memory go
+# to a temporary .npy memmap
+# tiles are coloured with the same lookup tables as save_image and encoded by a pool of threads, Pillow lets go of
+# the GIL while it compresses. Tiles of a single colour, like open ocean, are encoded once per colour and the same
+# bytes written for all of them. Tiles at the right and bottom edges are filled out with the colour of the sea
+
+TILE_SIZE = 256
+# a level bigger than this goes to a temporary memmap instead of memory
+LEVEL_MEMORY_BYTES = 256 * 2**20
+# tiles being encoded or waiting to be, per thread, so reading the map cannot run far ahead of the encoders
+TILES_PER_WORKER = 8
+# zlib level of the tiles, noisy terrain hardly compresses better at higher levels but takes twice as long
+COMPRESS_LEVEL = 1
+
+
+# the most zoomed in level of a map with this shape, level 0 is a single tile
+def max_zoom(shape, tile_size=TILE_SIZE):
+    return max(0, math.ceil(math.log2(max(shape) / tile_size)))
+
+# rows start to stop of a level, mapped on their own if the level is a memmap so its pages can be let go
+def _rows(level, start, stop):
+    if isinstance(level, np.memmap):
+        return strip(level, start, stop)
+    return level[start:stop]
+
+# the mean of every 2 x 2 block, an odd last row or column is averaged with itself
+# cellular grids stay 0 or 1, a block with at least 2 walls out of 4 is wall
+def downsample(values, cellular=False):
+    values = np.asarray(values, dtype=np.float32)
+    if values.shape[0] % 2 or values.shape[1] % 2:
+        values = np.pad(values, ((0, values.shape[0] % 2), (0, values.shape[1] % 2)), mode="edge")
+    blocks = values[0::2, 0::2] + values[1::2, 0::2]
+    blocks += values[0::2, 1::2]
+    blocks += values[1::2, 1::2]
+    blocks *= 0.25
+    if cellular:
+        return (blocks >= 0.5).astype(np.uint8)
+    return blocks
+
+# an empty level of this shape, in memory or in a temporary .npy file
+def _new_level(shape, dtype, directory):
+    if np.prod(shape) * np.dtype(dtype).itemsize <= LEVEL_MEMORY_BYTES:
+        return np.empty(shape, dtype=dtype)
+    path = os.path.join(directory, f"level{shape[0]}x{shape[1]}.npy")
+    return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+
+class _TileWriter:
+    def __init__(self, directory, workers):
+        self.directory = directory
+        self.pool = ThreadPoolExecutor(workers)
+        self.pending = threading.BoundedSemaphore(workers * TILES_PER_WORKER)
+        # encoded PNG of every single colour tile seen so far
+        self.uniform = {}
+        self.futures = []
+        self.tiles = 0
+        self.uniform_tiles = 0
+
+    def add(self, z, x, y, tile):
+        self.tiles += 1
+        path = os.path.join(self.directory, str(z), str(x), f"{y}.png")
+        if (tile == tile[0, 0]).all():
+            self.uniform_tiles += 1
+            colour = tuple(tile[0, 0])
+            if colour not in self.uniform:
+                self.uniform[colour] = _encode(tile)
+            _write(path, self.uniform[colour])
+            return
+        # waits here while the encoders are behind
+        self.pending.acquire()
+        future = self.pool.submit(self._encode_and_write, path, tile)
+        future.add_done_callback(lambda _: self.pending.release())
+        self.futures.append(future)
+
+    def _encode_and_write(self, path, tile):
+        _write(path, _encode(tile))
+
+    # waits for every tile and raises the first error any of them hit
+    def close(self):
+        self.pool.shutdown()
+        for future in self.futures:
+            future.result()
+
+
+def _encode(tile):
+    import io
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.fromarray(tile).save(buffer, format="PNG", compress_level=COMPRESS_LEVEL)
+    return buffer.getvalue()
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(data)
+
+
+# writes the tile pyramid of a heightmap (a numpy array or memmap) to directory/z/x/y.png, x counting tile
+# columns left to right and y tile rows top to bottom. cellular=True colours a 0/1 grid like the cellular
+# automaton. The colours of noise maps are stretched between the lowest and highest height of the whole map like
+# save_image does. workers=None uses one encoding thread per core. Returns the number of levels, tiles and
+# uniform tiles written
+def export_pyramid(heights, directory, tile_size=TILE_SIZE, cellular=False, workers=None):
+    if tile_size % 2:
+        raise ValueError(f"tile_size must be even, got {tile_size}")
+    if cellular:
+        colour = render_ca
+        sea = render_ca(np.ones((1, 1), dtype=np.uint8))[0, 0]
+        dtype = np.uint8
+    else:
+        low, high = strip_range(heights) if isinstance(heights, np.memmap) else (heights.min(), heights.max())
+        colour = lambda values: render_terrain(values, low=low, high=high)
+        sea = colour(np.full((1, 1), low))[0, 0]
+        dtype = np.float32
+
+    top = max_zoom(heights.shape, tile_size)
+    writer = _TileWriter(directory, workers or os.cpu_count() or 1)
+    with tempfile.TemporaryDirectory() as scratch:
+        level = heights
+        try:
+            for z in range(top, -1, -1):
+                rows, columns = level.shape
+                smaller = _new_level(((rows + 1) // 2, (columns + 1) // 2), dtype, scratch) if z else None
+                with stage("pyramid.level", zoom=z):
+                    for start in range(0, rows, tile_size):
+                        stop = min(start + tile_size, rows)
+                        values = _rows(level, start, stop)
+                        image = colour(values)
+                        for x, column in enumerate(range(0, columns, tile_size)):
+                            tile = np.empty((tile_size, tile_size, 3), dtype=np.uint8)
+                            tile[:] = sea
+                            part = image[:, column:column + tile_size]
+                            tile[:part.shape[0], :part.shape[1]] = part
+                            writer.add(z, x, start // tile_size, tile)
+                        if smaller is not None:
+                            smaller[start // 2:(stop + 1) // 2] = downsample(values, cellular)
+                        del values
+                if isinstance(smaller, np.memmap):
+                    smaller.flush()
+                level = smaller
+        finally:
+            writer.close()
+            # the temporary memmaps have to be closed before their directory is deleted on Windows
+            level = smaller = None
+    count("pyramid.tiles", writer.tiles)
+    count("pyramid.uniform_tiles", writer.uniform_tiles)
+    return {"levels": top + 1, "tiles": writer.tiles, "uniform_tiles": writer.uniform_tiles}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a heightmap .npy as a z/x/y tile pyramid of PNGs")
+    parser.add_argument("heights", help=".npy heightmap, e.g. from batch.py with format npy or a streamed job")
+    parser.add_argument("output", help="directory the z/x/y.png tiles are written to")
+    parser.add_argument("--tile-size", type=int, default=TILE_SIZE)
+    parser.add_argument("--cellular", action="store_true", help="colour a 0/1 grid like the cellular automaton")
+    parser.add_argument("--workers", type=int, help="PNG encoding threads, one per core by default")
+    args = parser.parse_args(argv)
+    heights = np.load(args.heights, mmap_mode="r")
+    result = export_pyramid(heights, args.output, args.tile_size, args.cellular, args.workers)
+    print(f"wrote {result['tiles']} tiles in {result['levels']} levels, {result['uniform_tiles']} of them a single colour")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import os
+import struct
+import zlib
+from functools import lru_cache
+import numpy as np
+
+# turns maps into RGB images for the GUI and the headless batch generator
+# nothing here imports customtkinter or a display backend, and Pillow is only imported once a colour table is built
+# or an image saved, so generating maps without drawing them never loads it
+# the colour stops are compiled once into a lookup table (LUT) of uint8 colours, then a whole heightmap is coloured
+# with a single array index and written at full resolution by Pillow, no Matplotlib figure involved
+
+# colours from https://medium.com/@travall/procedural-2d-island-generation-noise-functions-13976bddeaf9
+colors = {
+    "grass": '#7b9c50',
+    "water": '#0952c7',
+    "deepocean": '#003eaf',
+    "dirt": [114,98,49],
+    "sand": '#c2b282',
+    "wetsand": '#a49661',
+    "darkforest": '#3c6216',
+    "verydarkforest": [40,77,0],
+    "forest": "#5A7F33",
+    "mountain": "#8E907B",
+    "highmountain": "#9EA18E",
+    "snow": "white"
+}
+
+# height between 0-1 at which each colour of the OpenSimplex and Perlin noise maps is reached
+colour_stops = [(0, "deepocean"),
+                (0.37, "water"),
+                (0.46, "sand"),
+                (0.47, "wetsand"),
+                (0.56, "grass"),
+                (0.59, "forest"),
+                (0.64, "darkforest"),
+                (0.80, "mountain"),
+                (0.85, "highmountain"),
+                (1, "snow")]
+
+# land (0) and water (1) of the cellular automaton
+ca_colours = ["lawngreen", "royalblue"]
+
+# entries in the terrain LUT, enough that neighbouring heights never jump a visible step in colour
+LUT_SIZE = 4096
+
+
+# colour as 3 floats between 0-1, the colors dictionary also has some [r, g, b] lists out of 255
+def rgb(colour):
+    if isinstance(colour, list):
+        return tuple(channel / 255 for channel in colour)
+    # Pillow knows the same hex codes and CSS colour names as Matplotlib, and Matplotlib takes far longer to import
+    from PIL import ImageColor
+    return tuple(channel / 255 for channel in ImageColor.getrgb(colour))
+
+# colours between the stops are blended linearly, like the LinearSegmentedColormap this replaces
+@lru_cache(maxsize=4)
+def terrain_lut(size=LUT_SIZE):
+    stops = [stop for stop, _ in colour_stops]
+    stop_colours = np.array([rgb(colors[name]) for _, name in colour_stops])
+    heights = np.linspace(0, 1, size)
+    lut = np.stack([np.interp(heights, stops, stop_colours[:, channel]) for channel in range(3)], axis=1)
+    lut = np.round(lut * 255).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+@lru_cache(maxsize=1)
+def ca_lut():
+    lut = np.round(np.array([rgb(colour) for colour in ca_colours]) * 255).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+# RGB uint8 image of a noise heightmap, stretched between its min and max like imshow does
+# low and high default to the grid's own range, pass the whole map's range when grid is one strip of it
+def render_terrain(grid, size=LUT_SIZE, low=None, high=None):
+    grid = np.asarray(grid)
+    if low is None:
+        low = grid.min()
+    if high is None:
+        high = grid.max()
+    scale = (size - 1) / (high - low) if high > low else 0
+    indices = ((grid - low) * scale + 0.5).astype(np.intp)
+    return terrain_lut(size)[indices]
+
+# RGB uint8 image of a cellular automaton grid of 0s and 1s
+def render_ca(grid):
+    return ca_lut()[np.asarray(grid, dtype=np.intp)]
+
+def render(grid, cellular=False):
+    return render_ca(grid) if cellular else render_terrain(grid)
+
+# write a map straight to an image file at one pixel per cell, the format (png, webp, ...) comes from the extension
+def save_image(grid, path, cellular=False):
+    from PIL import Image
+    Image.fromarray(render(grid, cellular)).save(path)
+
+
+# writes an RGB PNG a strip of rows at a time, for images too big to hold in memory at once. Each strip is
+# compressed by zlib as it arrives and written out as its own IDAT chunk, so memory stays at one strip
+class PNGWriter:
+    def __init__(self, path, width, height, level=6):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self.compressor = zlib.compressobj(level)
+        # written next to the final file and renamed on close, like GifWriter
+        self.temporary = f"{path}.{os.getpid()}.tmp"
+        self.file = open(self.temporary, "wb")
+        self.file.write(b"\x89PNG\r\n\x1a\n")
+        # 8 bits per channel, colour type 2 (RGB), no interlacing
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self.file.write(struct.pack(">I", len(data)) + kind + data)
+        self.file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+    # image is a (rows, width, 3) uint8 strip, the next rows of the picture from the top
+    def add_rows(self, image):
+        image = np.asarray(image, dtype=np.uint8)
+        if image.shape[1:] != (self.width, 3):
+            raise ValueError(f"rows must have shape (n, {self.width}, 3), got {image.shape}")
+        # every row starts with its filter type, 0 meaning unfiltered
+        scanlines = np.zeros((image.shape[0], 1 + self.width * 3), dtype=np.uint8)
+        scanlines[:, 1:] = image.reshape(image.shape[0], -1)
+        data = self.compressor.compress(scanlines.tobytes())
+        if data:
+            self._chunk(b"IDAT", data)
+        self.rows += image.shape[0]
+
+    def close(self):
+        if self.rows != self.height:
+            raise ValueError(f"PNG has {self.height} rows but {self.rows} were written")
+        self._chunk(b"IDAT", self.compressor.flush())
+        self._chunk(b"IEND", b"")
+        self.file.close()
+        os.replace(self.temporary, self.path)
+
+    def discard(self):
+        self.file.close()
+        os.remove(self.temporary)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        if error_type is None:
+            self.close()
+        else:
+            self.discard()
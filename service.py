@@ -0,0 +1,273 @@
+import argparse
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import parse_qsl, urlsplit
+import numpy as np
+from batch import check_job, job_config, job_settings, job_size
+from cache import HeightmapCache, cached_generate, heightmap_key
+from helpers import BINARY_ALGORITHMS, generate_map
+from instrumentation import count, instrumentation, timer
+
+# a small local HTTP service that generates maps for other programs on the same machine, so tools asking for the
+# same map at the same time share one generation instead of each running their own
+# run with: python service.py --port 8765   (or --unix /tmp/terrain.sock)
+#
+#   GET /map?algorithm=perlin&size=1024&seed=3&island=true&format=png
+#   POST /map with a batch.py job as the JSON body, e.g. {"algorithm": "cellular", "size": [512, 256], "seed": 7}
+#       returns the map as a PNG (format=png, the default) or as a raw .npy heightmap (format=npy)
+#   GET /metrics
+#       Prometheus text of the requests, their latency, how many jobs are waiting and running, and every
+#       generation stage timed in this process
+#
+# requests for a map that is already being generated wait for that generation instead of starting another one
+# maps are generated in a pool of worker processes, one per core by default, and share the HeightmapCache in
+# Cache/ with the GUI and batch.py. Once MAX_QUEUE different maps are waiting or running, new ones are turned away
+# with 503 and a Retry-After header until some finish, so a burst of requests cannot pile up without limit
+# maps of more than MAX_PIXELS cells are refused with 400 before anything is generated, and a worker process that
+# dies (say killed for running out of memory) fails only the maps it was generating, the pool is started again
+
+SERVICE_FORMATS = ["png", "npy"]
+ROUTES = ["/map", "/metrics"]
+MAX_QUEUE = 64
+# 8192 x 8192, a float32 heightmap of 256 MB before it is encoded
+MAX_PIXELS = 8192 * 8192
+# bytes written to the socket before waiting for the client to read them
+CHUNK_BYTES = 2**20
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class ServiceBusy(Exception):
+    pass
+
+
+# runs in a worker process: generates the map of a checked job, or loads it from the cache, and encodes it
+def generate_response(job, cache_directory):
+    algorithm = job["algorithm"]
+    map_width, map_height = job_size(job)
+    settings = job_settings(job, job_config(job), job["seed"])
+    if cache_directory:
+        grid = cached_generate(HeightmapCache(cache_directory), algorithm, map_width, map_height, **settings)
+    else:
+        grid = generate_map(algorithm, map_width, map_height, **settings)
+    buffer = io.BytesIO()
+    if job.get("format", "png") == "npy":
+        np.save(buffer, grid)
+    else:
+        from PIL import Image
+        from rendering import render
+        Image.fromarray(render(grid, algorithm in BINARY_ALGORITHMS)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+# a job from the query string, values are read as JSON where they can be so size=512 is a number and
+# size=[512,256] a list, anything else stays a string
+def query_job(query):
+    job = {}
+    for name, value in parse_qsl(query):
+        try:
+            job[name] = json.loads(value)
+        except ValueError:
+            job[name] = value
+    return job
+
+
+class MapService:
+    def __init__(self, workers=None, max_queue=MAX_QUEUE, cache_directory="Cache", max_pixels=MAX_PIXELS):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.cache_directory = cache_directory
+        self.max_pixels = max_pixels
+        self.pool = self.new_pool()
+        # only as many jobs as workers are handed to the pool, the rest wait here where they can be counted
+        self.slots = asyncio.Semaphore(self.workers)
+        # key of every map waiting or being generated -> the future all its requests wait on
+        self.inflight = {}
+        self.queued = 0
+        self.running = 0
+
+    # workers are started as fresh processes rather than forked, a forked worker would inherit the listening
+    # socket and the open client connections, so closing a connection would never reach the client
+    def new_pool(self):
+        return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    # checks the job and fills in what decides the result, so requests for the same map get the same key
+    def normalise(self, job):
+        check_job(job)
+        if job.get("format", "png") not in SERVICE_FORMATS:
+            raise ValueError(f"format must be one of {SERVICE_FORMATS}, got {job.get('format')!r}")
+        if job.get("stream") or job.get("count", 1) != 1:
+            raise ValueError("the service generates one map in memory per request, stream and count are not supported")
+        job = dict(job)
+        if job.get("seed") is None:
+            job["seed"] = int(np.random.default_rng().integers(0, 2**31))
+        map_width, map_height = job_size(job)
+        if map_width * map_height > self.max_pixels:
+            raise ValueError(f"size {map_width} x {map_height} is more than the {self.max_pixels} pixels this service generates")
+        settings = job_settings(job, job_config(job), job["seed"])
+        del settings["workers"]
+        key = heightmap_key(job["algorithm"], map_width, map_height, **settings)
+        return job, f"{key}.{job.get('format', 'png')}"
+
+    # the encoded map for a job, shared with any identical request already waiting or running
+    async def result(self, job):
+        job, key = self.normalise(job)
+        future = self.inflight.get(key)
+        if future is not None:
+            count("service.coalesced")
+        else:
+            if len(self.inflight) >= self.max_queue:
+                raise ServiceBusy()
+            future = asyncio.ensure_future(self.run(job))
+            self.inflight[key] = future
+            future.add_done_callback(lambda _: self.inflight.pop(key, None))
+        # a client hanging up only cancels its own wait, not the generation the others are waiting on
+        return await asyncio.shield(future)
+
+    async def run(self, job):
+        self.queued += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.queued -= 1
+        self.running += 1
+        pool = self.pool
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, generate_response, job,
+                                                                    self.cache_directory)
+        except BrokenProcessPool:
+            # a worker died and took the pool with it, every job on it fails but the next ones get a new pool
+            count("service.broken_pool")
+            if self.pool is pool:
+                self.pool = self.new_pool()
+                pool.shutdown(wait=False)
+            raise RuntimeError("a map worker process died") from None
+        finally:
+            self.running -= 1
+            self.slots.release()
+
+    def metrics(self):
+        lines = ["# TYPE terrain_service_jobs gauge",
+                 f'terrain_service_jobs{{state="queued"}} {self.queued}',
+                 f'terrain_service_jobs{{state="running"}} {self.running}',
+                 "# TYPE terrain_service_workers gauge",
+                 f"terrain_service_workers {self.workers}"]
+        return instrumentation.prometheus_text() + "\n".join(lines) + "\n"
+
+    # one request per connection: reads it, answers it and closes the connection
+    async def handle(self, reader, writer):
+        start = time.perf_counter()
+        path = None
+        try:
+            try:
+                method, path, query, body = await read_request(reader)
+                status, content_type, content, headers = await self.respond(method, path, query, body)
+            except (ValueError, KeyError) as error:
+                status, content_type, content, headers = 400, "text/plain", f"{error}\n".encode(), {}
+            except ServiceBusy:
+                status, content_type, content, headers = 503, "text/plain", b"too many maps waiting\n", {"Retry-After": "1"}
+            except Exception as error:
+                status, content_type, content, headers = 500, "text/plain", f"{error!r}\n".encode(), {}
+            await write_response(writer, status, content_type, content, headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            status = "disconnected"
+        finally:
+            writer.close()
+        count("service.requests", status=status)
+        # any other path is labelled other, so random paths cannot add a new series each to the metrics
+        timer("service.request", time.perf_counter() - start, path=path if path in ROUTES else "other")
+
+    async def respond(self, method, path, query, body):
+        if path == "/metrics":
+            return 200, "text/plain; version=0.0.4", self.metrics().encode(), {}
+        if path != "/map":
+            return 404, "text/plain", b"not found, try /map or /metrics\n", {}
+        if method == "GET":
+            job = query_job(query)
+        elif method == "POST":
+            job = json.loads(body)
+        else:
+            return 405, "text/plain", b"use GET or POST\n", {"Allow": "GET, POST"}
+        content = await self.result(job)
+        content_type = "image/png" if job.get("format", "png") == "png" else "application/octet-stream"
+        return 200, content_type, content, {}
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+# (method, path, query string, body) of an HTTP/1.1 request
+async def read_request(reader):
+    request_line = (await reader.readline()).decode("latin-1").split()
+    if len(request_line) != 3:
+        raise ValueError("malformed request line")
+    method, target, _ = request_line
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    body = await reader.readexactly(length) if length else b""
+    url = urlsplit(target)
+    return method, url.path, url.query, body
+
+# sends the content a chunk at a time, waiting for the client to keep up so a big map is not all buffered at once
+async def write_response(writer, status, content_type, content, headers):
+    head = [f"HTTP/1.1 {status} {STATUS_TEXT[status]}", f"Content-Type: {content_type}",
+            f"Content-Length: {len(content)}", "Connection: close"]
+    head += [f"{name}: {value}" for name, value in headers.items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+    view = memoryview(content)
+    for start in range(0, len(view), CHUNK_BYTES):
+        writer.write(view[start:start + CHUNK_BYTES])
+        await writer.drain()
+    await writer.drain()
+
+
+async def serve(host="127.0.0.1", port=8765, unix=None, workers=None, max_queue=MAX_QUEUE, cache_directory="Cache",
+                max_pixels=MAX_PIXELS):
+    service = MapService(workers, max_queue, cache_directory, max_pixels)
+    if unix:
+        server = await asyncio.start_unix_server(service.handle, path=unix)
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+    print(f"serving maps on {unix or f'http://{host}:{port}'}", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve generated maps over local HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="listen on this Unix socket path instead of a TCP port")
+    parser.add_argument("--workers", type=int, help="generator processes, one per core by default")
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE, help="different maps waiting or running before new ones get 503")
+    parser.add_argument("--max-pixels", type=int, default=MAX_PIXELS, help="biggest map in pixels, bigger ones get 400")
+    parser.add_argument("--cache", default="Cache", help="HeightmapCache directory shared with the GUI and batch.py")
+    parser.add_argument("--no-cache", action="store_true", help="always generate, never read or write the cache")
+    args = parser.parse_args(argv)
+    # the request counters and latencies for /metrics
+    instrumentation.enable()
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix, args.workers, args.max_queue,
+                          None if args.no_cache else args.cache, args.max_pixels))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from filename import highest_numbers
+from instrumentation import stage
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# saved maps, numbered like island1.png, island2.png, ... without listing the directory on every save
+# the last number handed out for every name and extension is kept in sequence.json, and read and bumped under a
+# lock on the .lock file, so several processes saving at once (the GUI and batch runs) never get the same number
+# every file is written under a temporary name and renamed into place once it is complete, then a JSON line with
+# its settings is appended to manifest.jsonl, which is never rewritten. Files go into shard directories of
+# SHARD_SIZE numbers each (0000/island1.png, ..., 0001/island1000.png) so no directory gets too big to open
+# the first time a directory is used, the numbers are taken from the files already in it, so old saves are never
+# overwritten
+SHARD_SIZE = 1000
+SEQUENCE = "sequence.json"
+MANIFEST = "manifest.jsonl"
+LOCK = ".lock"
+
+
+# settings like NoiseConfig objects and numpy numbers written as plain JSON
+def _json_default(value):
+    if hasattr(value, "item"):
+        return value.item()
+    if hasattr(value, "__dict__"):
+        return vars(value)
+    raise TypeError(f"cannot store {type(value).__name__} in the manifest")
+
+
+class OutputStore:
+    def __init__(self, directory="Saved", shard_size=SHARD_SIZE):
+        self.directory = directory
+        self.shard_size = shard_size
+        os.makedirs(directory, exist_ok=True)
+
+    # holds the lock on the directory, it is released when the process exits even if it crashes
+    @contextmanager
+    def lock(self):
+        with open(os.path.join(self.directory, LOCK), "a+b") as file:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            else:
+                file.seek(0)
+                while True:
+                    try:
+                        # LK_LOCK only retries for 10 seconds before giving up
+                        msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        pass
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+                else:
+                    file.seek(0)
+                    msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    # last number of every "name.extension", taken from the files already saved the first time
+    # only called with the lock held
+    def _sequence(self):
+        try:
+            with open(os.path.join(self.directory, SEQUENCE)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            pass
+        with stage("store.migrate"):
+            files = []
+            for entry in os.scandir(self.directory):
+                if entry.is_dir() and entry.name.isdigit():
+                    files.extend(os.listdir(entry.path))
+                else:
+                    files.append(entry.name)
+            return {base_name + extension: number for (base_name, extension), number in highest_numbers(files).items()}
+
+    def _write_sequence(self, sequence):
+        path = os.path.join(self.directory, SEQUENCE)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(sequence, file)
+        os.replace(temporary, path)
+
+    # the next number for base_name and extension, never handed out again even if it is not saved in the end
+    def allocate(self, base_name, extension):
+        with stage("store.allocate"), self.lock():
+            sequence = self._sequence()
+            number = sequence.get(base_name + extension, 0) + 1
+            sequence[base_name + extension] = number
+            self._write_sequence(sequence)
+        return number
+
+    def path(self, base_name, number, extension):
+        return os.path.join(self.directory, f"{number // self.shard_size:04d}", f"{base_name}{number}{extension}")
+
+    # saves the next numbered file, e.g. store.save("island", ".png", lambda path: save_image(grid, path))
+    # write(path) writes the whole file to path, which is a temporary name with the same extension. metadata such as
+    # the algorithm, config, seed and timings goes into the manifest with the file. Returns the final path
+    def save(self, base_name, extension, write, **metadata):
+        number = self.allocate(base_name, extension)
+        path = self.path(base_name, number, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._write(path, write, metadata, name=base_name, number=number)
+        return path
+
+    # saves a file with a name chosen by the caller, e.g. batch.py's job0_perlin_seed5.png, straight into the
+    # directory, replacing any earlier file of that name
+    def put(self, filename, write, **metadata):
+        path = os.path.join(self.directory, filename)
+        self._write(path, write, metadata)
+        return path
+
+    def _write(self, path, write, metadata, **entry):
+        stem, extension = os.path.splitext(path)
+        # the extension stays last so Pillow and numpy pick the right format
+        temporary = f"{stem}.{os.getpid()}.{threading.get_ident()}.tmp{extension}"
+        with stage("store.save", extension=extension):
+            start = time.perf_counter()
+            try:
+                write(temporary)
+                os.replace(temporary, path)
+            except BaseException:
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+                raise
+            seconds = time.perf_counter() - start
+        metadata.setdefault("timings", {})["save"] = seconds
+        entry.update(path=os.path.relpath(path, self.directory), created=datetime.now(timezone.utc).isoformat(),
+                     **metadata)
+        self.record(entry)
+
+    # appends one line to the manifest, the lock stops lines from two processes being interleaved
+    def record(self, entry):
+        line = json.dumps(entry, default=_json_default) + "\n"
+        with self.lock(), open(os.path.join(self.directory, MANIFEST), "a") as file:
+            file.write(line)
+
+    # every file saved so far, oldest first, as the dictionaries written by save and put
+    def entries(self):
+        try:
+            with open(os.path.join(self.directory, MANIFEST)) as file:
+                for line in file:
+                    if line.strip():
+                        yield json.loads(line)
+        except FileNotFoundError:
+            return
@@ -0,0 +1,96 @@
+import numpy as np
+from helpers import NOISE_REGIONS, NoiseGenerator, default_config
+from instrumentation import stage
+from masks import apply_mask, mask_rows
+from rendering import PNGWriter, render_terrain
+
+# generates noise maps too big to hold in memory (16384 x 16384 and up) a strip of rows at a time
+# the heights go into a .npy file on disk through np.memmap, and every later pass (the island mask, the colour
+# rendering) reads it back a strip at a time too. Each strip is mapped on its own and let go once it is done, so
+# the memory used is set by the strip size and not the map size
+# the saved .npy can be opened again with np.load(path, mmap_mode="r")
+
+# bytes of float64 heights in one strip, a few temporary arrays of this size are alive while a strip is worked on
+STRIP_BYTES = 4 * 2**20
+
+
+# rows per strip for a map with this many columns, so a strip stays at STRIP_BYTES however wide the map is
+def strip_rows_for(columns):
+    return max(1, STRIP_BYTES // (columns * 8))
+
+# (start, stop) of every strip of rows
+def strips(rows, strip_rows):
+    for start in range(0, rows, strip_rows):
+        yield start, min(start + strip_rows, rows)
+
+# rows start to stop of a .npy memmap, mapped on their own so their pages are released when the strip is deleted
+def strip(heights, start, stop, mode="r"):
+    return np.memmap(heights.filename, dtype=heights.dtype, mode=mode, offset=heights.offset + start * heights.strides[0],
+                     shape=(stop - start,) + heights.shape[1:])
+
+# lowest and highest height of the whole map, read a strip at a time
+def strip_range(heights, strip_rows=None):
+    strip_rows = strip_rows or strip_rows_for(heights.shape[1])
+    low, high = np.inf, -np.inf
+    for start, stop in strips(heights.shape[0], strip_rows):
+        values = strip(heights, start, stop)
+        low = min(low, values.min())
+        high = max(high, values.max())
+        del values
+    return low, high
+
+# generates the map into a .npy file at path and returns it opened read-only as a memmap
+# the same settings and seed give the same map as generate_map, stored as dtype (float32 by default to halve the
+# file, float64 matches generate_map exactly). strip_rows defaults to strip_rows_for(map_height)
+# progress(rows done, total rows) is called after every strip and can raise GenerationCancelled
+# only the noise algorithms can be streamed, the cellular automaton needs the whole grid for every step
+def generate_streamed(path, algorithm, map_width, map_height, config=None, chooseisland=False, seed=None,
+                      strip_rows=None, dtype=np.float32, island_kind="square", progress=None):
+    if algorithm not in NOISE_REGIONS:
+        raise ValueError(f"algorithm must be one of {list(NOISE_REGIONS)}, got {algorithm!r}")
+    strip_rows = strip_rows or strip_rows_for(map_height)
+    if config is None:
+        config = default_config(algorithm)
+    generator = NoiseGenerator(None, map_width, map_height, config, chooseisland, seed=seed, island_kind=island_kind)
+    region = getattr(generator, NOISE_REGIONS[algorithm])
+    # creates the file at its full size without touching its pages
+    heights = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(map_width, map_height))
+    columns = np.arange(map_height)
+
+    # the island mask scales the heights by the range of the whole map, so it needs a second pass over the strips
+    low, high = np.inf, -np.inf
+    with stage("stream.generate", algorithm=algorithm):
+        for start, stop in strips(map_width, strip_rows):
+            values = region(np.arange(start, stop), columns)
+            low = min(low, values.min())
+            high = max(high, values.max())
+            out = strip(heights, start, stop, "r+")
+            out[:] = values
+            out.flush()
+            del out
+            if progress is not None:
+                progress(stop, map_width)
+
+    if chooseisland == True:
+        with stage("stream.island_gradient"):
+            for start, stop in strips(map_width, strip_rows):
+                out = strip(heights, start, stop, "r+")
+                mask = mask_rows((map_width, map_height), start, stop, island_kind)
+                out[:] = apply_mask(np.asarray(out, dtype=np.float64), mask, low, high)
+                out.flush()
+                del out
+
+    del heights
+    return np.load(path, mmap_mode="r")
+
+# writes a heightmap, e.g. the memmap from generate_streamed, to a PNG at one pixel per cell a strip at a time
+# coloured like save_image, stretched between the lowest and highest height of the whole map
+def save_streamed_image(heights, path, strip_rows=None):
+    strip_rows = strip_rows or strip_rows_for(heights.shape[1])
+    low, high = strip_range(heights, strip_rows)
+    with stage("stream.save"), PNGWriter(path, heights.shape[1], heights.shape[0]) as writer:
+        for start, stop in strips(heights.shape[0], strip_rows):
+            values = strip(heights, start, stop)
+            writer.add_rows(render_terrain(values, low=low, high=high))
+            del values
+    return path
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+from bands import run_banded
+from helpers import CellularAutomaton, cellular_automaton_step
+
+# run with: python -m pytest  (from the top folder, so the modules can be imported)
+# the cellular automaton rule has been rewritten a few times for speed, each version has to give exactly the same
+# maps as the original loop over every cell below, including cells off the edge of the map counting as wall
+
+SHAPES = [(1, 1), (3, 7), (24, 17), (40, 57)]
+DENSITIES = [40, 50, 60]
+GENERATIONS = 6
+
+
+# one generation as the first version of CellularAutomaton.cellular_automaton worked it out
+def reference_step(grid):
+    map_width, map_height = grid.shape
+    copy = np.copy(grid)
+    result = np.copy(grid)
+    for row in range(map_width):
+        for column in range(map_height):
+            neighbour_wall_count = 0
+            for j in range(row - 1, row + 2):
+                for k in range(column - 1, column + 2):
+                    if j < 0 or k < 0 or j > map_width - 1 or k > map_height - 1:
+                        neighbour_wall_count += 1
+                    elif j != row or k != column:
+                        if copy[j][k] == 1:
+                            neighbour_wall_count += 1
+            if neighbour_wall_count > 4:
+                result[row][column] = 1
+            else:
+                result[row][column] = 0
+    return result
+
+def noise(shape, density, seed):
+    automaton = CellularAutomaton(np.zeros(shape, dtype=np.uint8), density, shape[0], shape[1], False, seed=seed)
+    return automaton.noise_grid().copy()
+
+def reference_run(grid, generations):
+    for _ in range(generations):
+        grid = reference_step(grid)
+    return grid
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("density", DENSITIES)
+def test_step_matches_loop(shape, density):
+    grid = noise(shape, density, seed=1)
+    expected = grid
+    for _ in range(GENERATIONS):
+        expected = reference_step(expected)
+        grid = cellular_automaton_step(grid)
+        assert np.array_equal(grid, expected)
+
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("density", DENSITIES)
+def test_run_matches_loop(shape, density):
+    # run stops early at a fixed point or 2-cycle, the map still has to be the one after every generation
+    grid = noise(shape, density, seed=2)
+    automaton = CellularAutomaton(grid.copy(), density, shape[0], shape[1], False)
+    for generations in (1, GENERATIONS, 3 * GENERATIONS + 1):
+        automaton.map[:, :] = grid
+        automaton.reset_changes()
+        automaton.run(generations)
+        assert np.array_equal(automaton.map, reference_run(grid, generations))
+
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("workers", [1, 3])
+def test_banded_matches_loop(shape, workers):
+    grid = noise(shape, 50, seed=3)
+    automaton = CellularAutomaton(grid.copy(), 50, shape[0], shape[1], False)
+    run_banded(automaton, GENERATIONS, workers=workers)
+    assert np.array_equal(automaton.map, reference_run(grid, GENERATIONS))
+
+def test_float_map_matches_loop():
+    # the map used to be a float64 array, the incremental steps must not need an integer one
+    shape = (64, 48)
+    automaton = CellularAutomaton(np.empty(shape), 50, shape[0], shape[1], False, seed=1)
+    grid = automaton.noise_grid().astype(np.uint8)
+    automaton.run(40)
+    assert automaton.map.dtype == np.float64
+    assert np.array_equal(automaton.map, reference_run(grid, 40))
@@ -0,0 +1,66 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from helpers import NoiseGenerator, NOISE_REGIONS
+
+# splits a noise map into square tiles and generates them in a pool of worker processes
+# every worker writes its tiles straight into one shared memory array, so nothing is copied back through pickling
+# the noise at a pixel only depends on its row, column and the generator's seed, so the assembled map
+# is exactly the same as generating the whole map in one process, and any tile can be regenerated by itself
+
+TILE_SIZE = 256
+
+
+# (row start, row end, column start, column end) of every tile covering the map
+def tiles(map_width, map_height, tile_size=TILE_SIZE):
+    return [(row, min(row + tile_size, map_width), column, min(column + tile_size, map_height))
+            for row in range(0, map_width, tile_size)
+            for column in range(0, map_height, tile_size)]
+
+
+# heights for one tile of the generator's map, without the island gradient
+def generate_tile(generator, algorithm, tile, out=None):
+    row_start, row_end, column_start, column_end = tile
+    region = getattr(generator, NOISE_REGIONS[algorithm])
+    return region(np.arange(row_start, row_end), np.arange(column_start, column_end), out=out)
+
+
+# each worker process attaches to the shared map and builds its own generator once, then reuses them for every tile
+_worker = {}
+
+def _init_worker(memory_name, shape, config, seed, algorithm):
+    memory = shared_memory.SharedMemory(name=memory_name)
+    _worker["memory"] = memory
+    _worker["map"] = np.ndarray(shape, dtype=np.float64, buffer=memory.buf)
+    _worker["generator"] = NoiseGenerator(None, shape[0], shape[1], config, False, seed=seed)
+    _worker["algorithm"] = algorithm
+
+def _generate_shared_tile(tile):
+    row_start, row_end, column_start, column_end = tile
+    generate_tile(_worker["generator"], _worker["algorithm"], tile,
+                  out=_worker["map"][row_start:row_end, column_start:column_end])
+    return tile
+
+
+# fills generator.map like generator.opensimplex() or generator.perlinnoise2() would, but tile by tile across processes
+# workers=None uses one process per core, the island gradient is applied afterwards because it needs the whole map
+def generate_tiled(generator, algorithm, tile_size=TILE_SIZE, workers=None):
+    shape = (generator.map_width, generator.map_height)
+    memory = shared_memory.SharedMemory(create=True, size=shape[0] * shape[1] * np.dtype(np.float64).itemsize)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(memory.name, shape, generator.config, generator.seed, algorithm)) as pool:
+            for _ in pool.map(_generate_shared_tile, tiles(shape[0], shape[1], tile_size)):
+                pass
+        shared_map = np.ndarray(shape, dtype=np.float64, buffer=memory.buf)
+        if generator.map is None:
+            generator.map = np.empty(shape)
+        generator.map[:, :] = shared_map
+        del shared_map
+    finally:
+        memory.close()
+        memory.unlink()
+
+    if generator.chooseisland == True:
+        generator.map = generator.applyislandgradient()
+    return generator.map